@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# Multiplier applied to every absolute budget in test_kernels.py, for slower CI
+# machines or profiling runs.
+BUDGET_SCALE = float(os.getenv("BENCH_BUDGET_SCALE", "1"))
+
+
+@pytest.fixture
+def within_budget(benchmark):
+    """Assert the benchmark's mean stays under `seconds * BENCH_BUDGET_SCALE`"""
+    def check(seconds):
+        if benchmark.stats is None:  # --benchmark-disable
+            return
+        mean = benchmark.stats.stats.mean
+        budget = seconds * BUDGET_SCALE
+        assert mean <= budget, f"mean {mean:.4f}s exceeds regression budget {budget:.4f}s"
+    return check
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+Concurrent load benchmark for the Forest Management GIS API
+
+Seeds a dedicated Mongo database with a synthetic forest, drives every
+endpoint concurrently with httpx and reports latency percentiles, RPS and
+memory per endpoint. Run from legacy_rn/backend after
+`pip install -r requirements.txt -r benchmarks/requirements.txt`:
+
+    # against a running server (pass its pid to sample RSS)
+    python benchmarks/load_benchmark.py --base-url http://localhost:8001 --server-pid 1234
+
+    # in-process through ASGI, memory measured with tracemalloc in a second pass
+    python benchmarks/load_benchmark.py --in-process --trees 100000 --output run.json
+
+    # compare against an earlier run
+    python benchmarks/load_benchmark.py --in-process --compare run.json
+
+The server must use the same database as the seeder (DATABASE_NAME), which
+is forced automatically in --in-process mode. Seeding drops every
+collection the scenarios write to, indexes included, so runs start from
+the same state; for --base-url runs seed first and start the server
+afterwards, so it rebuilds its indexes and starts with empty caches:
+
+    python benchmarks/load_benchmark.py --seed-only
+    python benchmarks/load_benchmark.py --base-url http://localhost:8001 --no-seed
+
+The report also has a `startup` section: `import server` time in fresh
+interpreters with the slowest top-level imports (python -X importtime), and
+in --in-process mode the time until /api/ready first answers 200.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks import synthetic  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--in-process", action="store_true", help="serve the app through httpx.ASGITransport")
+    parser.add_argument("--server-pid", type=int, help="pid of the server (RSS of it and its children is sampled)")
+    parser.add_argument("--mongo-url", default=os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default=os.getenv("BENCH_DATABASE_NAME", "forest_management_bench"))
+    parser.add_argument("--org-id", default="default", help="organization the data is seeded for and requested as")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the data already in the database")
+    parser.add_argument("--seed-only", action="store_true", help="seed the database and exit")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--areas", type=int, default=50)
+    parser.add_argument("--trees", type=int, default=20000)
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--track-points", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--heavy-requests", type=int, default=10, help="requests per export/report endpoint")
+    parser.add_argument("--endpoints", help="comma separated subset of endpoint names")
+    parser.add_argument("--startup-runs", type=int, default=3, help="fresh interpreters for the import profile")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="earlier JSON report to diff against")
+    return parser.parse_args(argv)
+
+
+# Seeding
+
+# Everything the write scenarios append to, so repeated runs stay comparable
+SEEDED_COLLECTIONS = (
+    "trees", "work_areas", "gps_tracks", "tree_observations", "analytics_rollups", "revisions",
+    "idempotency_keys", "vector_layers", "vector_features",
+)
+
+
+async def seed_database(args):
+    client = AsyncIOMotorClient(args.mongo_url)
+    db = client[args.database]
+    for name in SEEDED_COLLECTIONS:
+        await db[name].drop()
+
+    areas = synthetic.make_work_areas(args.areas, seed=args.seed)
+    trees = synthetic.make_trees(args.trees, areas=areas, seed=args.seed)
+    tracks = synthetic.make_gps_tracks(args.tracks, args.track_points, seed=args.seed)
+    for doc in (*areas, *trees, *tracks):
+        doc["org_id"] = args.org_id
+
+    if areas:
+        await db.work_areas.insert_many(areas)
+    for i in range(0, len(trees), 10000):
+        await db.trees.insert_many(trees[i:i + 10000])
+    for track in tracks:
+        await db.gps_tracks.insert_one(track)
+
+    client.close()
+    return {"areas": [a["id"] for a in areas], "trees": [t["id"] for t in trees[:1000]]}
+
+
+async def load_ids(args):
+    client = AsyncIOMotorClient(args.mongo_url)
+    db = client[args.database]
+    areas = await db.work_areas.find({"org_id": args.org_id}, {"id": 1}).to_list(None)
+    trees = await db.trees.find({"org_id": args.org_id}, {"id": 1}).limit(1000).to_list(None)
+    client.close()
+    return {"areas": [a["id"] for a in areas], "trees": [t["id"] for t in trees]}
+
+
+# Endpoint scenarios: name -> (method, builder, heavy). Builders return (path, json_body).
+
+def build_endpoints(ids, args):
+    rng = random.Random(args.seed)
+    track_points = synthetic.make_track_points(args.track_points, seed=args.seed)
+
+    def pick(seq):
+        return rng.choice(seq) if seq else "missing"
+
+    def new_tree():
+        tree = synthetic.make_trees(1, seed=rng.randrange(1 << 30))[0]
+        body = {k: tree[k] for k in ("species", "health", "lat", "lng", "diameter", "height", "notes")}
+        body["area_id"] = pick(ids["areas"])
+        return "/api/trees", body
+
+    return {
+        "root": ("GET", lambda: ("/", None), False),
+        "trees.list": ("GET", lambda: ("/api/trees", None), True),
+        "trees.list_by_area": ("GET", lambda: (f"/api/trees?area_id={pick(ids['areas'])}", None), False),
+        "trees.list_by_health": ("GET", lambda: ("/api/trees?health=critical", None), True),
+        "trees.get": ("GET", lambda: (f"/api/trees/{pick(ids['trees'])}", None), False),
+        "trees.create": ("POST", new_tree, False),
+        "trees.update": ("PUT", lambda: (f"/api/trees/{pick(ids['trees'])}",
+                                         {"health": rng.choice(synthetic.HEALTH),
+                                          "diameter": round(rng.uniform(8, 80), 1)}), False),
+        "trees.history": ("GET", lambda: (f"/api/trees/{pick(ids['trees'])}/history", None), False),
+        "trees.survey": ("POST", lambda: ("/api/trees/survey", {"observations": [
+            {"tree_id": pick(ids["trees"]), "health": rng.choice(synthetic.HEALTH),
+             "diameter": round(rng.uniform(8, 80), 1)} for _ in range(50)]}), False),
+        "work_areas.trends": ("GET", lambda: (f"/api/work-areas/{pick(ids['areas'])}/trends", None), False),
+        "trees.nearest": ("GET", lambda: (
+            f"/api/trees/nearest?lat={synthetic.ORIGIN_LAT + rng.uniform(0, 0.01)}"
+            f"&lng={synthetic.ORIGIN_LNG + rng.uniform(0, 0.01)}&k=20", None), False),
+        "trees.nearest_batch": ("POST", lambda: ("/api/trees/nearest/batch", {"k": 5, "queries": [
+            {"lat": synthetic.ORIGIN_LAT + rng.uniform(0, 0.01), "lng": synthetic.ORIGIN_LNG + rng.uniform(0, 0.01)}
+            for _ in range(50)]}), False),
+        "work_areas.list": ("GET", lambda: ("/api/work-areas", None), False),
+        "work_areas.list_full": ("GET", lambda: ("/api/work-areas?detail=full", None), False),
+        "work_areas.create": ("POST", lambda: ("/api/work-areas", {
+            "name": "bench", "boundary": synthetic.make_traced_boundary(5000, seed=rng.randrange(1 << 30))}), False),
+        "work_areas.get": ("GET", lambda: (f"/api/work-areas/{pick(ids['areas'])}", None), False),
+        "gps_tracks.list": ("GET", lambda: ("/api/gps-tracks", None), True),
+        "gps_tracks.create": ("POST", lambda: ("/api/gps-tracks",
+                                               {"name": "bench", "points": track_points, "track_type": "path"}), False),
+        "analytics.summary": ("GET", lambda: ("/api/analytics/summary", None), False),
+        "analytics.species": ("GET", lambda: ("/api/analytics/species-distribution", None), False),
+        "analytics.trees_per_day": ("GET", lambda: ("/api/analytics/trees-per-day", None), False),
+        "analytics.stands": ("GET", lambda: ("/api/analytics/stands", None), False),
+        "analytics.stands_polygon": ("POST", lambda: ("/api/analytics/stands/polygon", {"boundary": [
+            [synthetic.ORIGIN_LAT, synthetic.ORIGIN_LNG], [synthetic.ORIGIN_LAT + 0.01, synthetic.ORIGIN_LNG],
+            [synthetic.ORIGIN_LAT + 0.01, synthetic.ORIGIN_LNG + 0.01]]}), False),
+        "analytics.heatmap": ("GET", lambda: (
+            f"/api/analytics/heatmap?bbox={synthetic.ORIGIN_LAT},{synthetic.ORIGIN_LNG},"
+            f"{synthetic.ORIGIN_LAT + 0.05},{synthetic.ORIGIN_LNG + 0.05}&cell_size=25&metric=health", None), False),
+        "analytics.heatmap_tile": ("GET", lambda: ("/api/analytics/heatmap/tiles/14/14547/6451.png", None), False),
+        "export.json": ("GET", lambda: ("/api/export/json", None), True),
+        "export.csv": ("GET", lambda: ("/api/export/csv", None), True),
+        "reports.full": ("GET", lambda: ("/api/reports/generate/full", None), True),
+    }
+
+
+# Memory sampling
+
+def rss_bytes(pid):
+    """RSS of a process plus all of its descendants (Linux /proc)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+class MemoryProbe:
+    def __init__(self, in_process, server_pid):
+        self.in_process = in_process
+        self.server_pid = server_pid
+        self.peak = 0
+        self._task = None
+
+    async def _sample(self):
+        while True:
+            self.peak = max(self.peak, rss_bytes(self.server_pid))
+            await asyncio.sleep(0.05)
+
+    def start(self):
+        if self.in_process:
+            tracemalloc.start()
+            self.before = tracemalloc.get_traced_memory()[0]
+        elif self.server_pid:
+            self.before = rss_bytes(self.server_pid)
+            self.peak = self.before
+            self._task = asyncio.create_task(self._sample())
+
+    async def stop(self):
+        if self.in_process:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return {"kind": "tracemalloc", "peak_delta_bytes": peak - self.before,
+                    "retained_delta_bytes": current - self.before}
+        if self.server_pid:
+            self._task.cancel()
+            after = rss_bytes(self.server_pid)
+            return {"kind": "rss", "before_bytes": self.before, "peak_bytes": self.peak,
+                    "after_bytes": after, "peak_delta_bytes": self.peak - self.before}
+        return None
+
+
+# Startup
+
+def _parse_importtime(stderr):
+    """Top-level imports of server.py from -X importtime output, slowest first"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        # server itself is at depth 0, its own imports one level (2 spaces) deeper
+        if len(name) - len(name.lstrip()) == 3:
+            modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000,
+                            "cumulative_ms": int(cumulative_us) / 1000})
+    return sorted(modules, key=lambda m: m["cumulative_ms"], reverse=True)
+
+
+def measure_import(runs, top=10):
+    """Median wall time of `import server` in fresh interpreters plus its import profile"""
+    code = "import time; start = time.perf_counter(); import server; print(time.perf_counter() - start)"
+    env = {**os.environ, "LOOP_DEBUG": "0"}
+    times, profile = [], []
+    for _ in range(max(1, runs)):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=BACKEND_DIR, env=env,
+                              capture_output=True, text=True, check=True)
+        times.append(float(proc.stdout.strip().splitlines()[-1]))
+        profile = _parse_importtime(proc.stderr)
+    return {"import_s": statistics.median(times), "import_runs_s": times, "import_profile": profile[:top]}
+
+
+async def wait_ready(http, timeout=60):
+    """Seconds until /api/ready answers 200"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        response = await http.get("/api/ready")
+        if response.status_code == 200:
+            return time.perf_counter() - start
+        await asyncio.sleep(0.05)
+    return None
+
+
+def print_startup(startup):
+    ready_s = startup.get("ready_s")
+    print(f"startup: import server {startup['import_s'] * 1000:.0f} ms (median of {len(startup['import_runs_s'])}), "
+          f"ready after {_fmt(ready_s * 1000 if ready_s is not None else None, '.0f')} ms")
+    for module in startup["import_profile"]:
+        print(f"  {module['module']:<28} {module['cumulative_ms']:>8.1f} ms")
+
+
+# Driver
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_endpoint(http, name, method, builder, total, concurrency, memory=None):
+    latencies = []
+    errors = 0
+    statuses = {}
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in counter:
+            path, body = builder()
+            start = time.perf_counter()
+            try:
+                response = await http.request(method, path, json=body)
+                await response.aread()
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    if memory:
+        memory.start()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    wall = time.perf_counter() - wall_start
+    mem = await memory.stop() if memory else None
+
+    latencies.sort()
+    return {
+        "endpoint": name,
+        "method": method,
+        "requests": total,
+        "errors": errors,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "wall_seconds": wall,
+        "rps": total / wall if wall else None,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "memory": mem,
+    }
+
+
+async def run(args):
+    ids = await seed_database(args) if not args.no_seed else await load_ids(args)
+    if args.seed_only:
+        return
+    endpoints = build_endpoints(ids, args)
+    if args.endpoints:
+        wanted = args.endpoints.split(",")
+        endpoints = {k: v for k, v in endpoints.items() if k in wanted}
+
+    startup = measure_import(args.startup_runs)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(120.0)
+    headers = {"X-Org-Id": args.org_id}
+    lifespan = None
+    if args.in_process:
+        os.environ["DATABASE_NAME"] = args.database
+        os.environ["MONGO_URL"] = args.mongo_url
+        os.chdir(BACKEND_DIR)  # server.py serves ./uploads relative to cwd
+        import server
+        lifespan = server.app.router.lifespan_context(server.app)
+        await lifespan.__aenter__()
+        transport = httpx.ASGITransport(app=server.app)
+        http = httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=timeout,
+                                 headers=headers)
+        startup["ready_s"] = await wait_ready(http)
+    else:
+        http = httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout, headers=headers)
+    print_startup(startup)
+
+    memory = MemoryProbe(args.in_process, args.server_pid)
+    results = []
+    try:
+        for name, (method, builder, heavy) in endpoints.items():
+            total = args.heavy_requests if heavy else args.requests
+            if args.in_process:
+                # tracemalloc slows allocation several-fold, so latencies come
+                # from a pass without it and memory from a second, untimed one
+                result = await run_endpoint(http, name, method, builder, total, args.concurrency)
+                traced = await run_endpoint(http, name, method, builder, total, args.concurrency, memory)
+                result["memory"] = traced["memory"]
+            else:
+                result = await run_endpoint(http, name, method, builder, total, args.concurrency, memory)
+            results.append(result)
+            print_result(result)
+    finally:
+        await http.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+    return {
+        "generated_at": datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "startup": startup,
+        "results": results,
+    }
+
+
+# Reporting
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _fmt(value, spec=".1f"):
+    return "-" if value is None else format(value, spec)
+
+
+def print_result(result):
+    lat = result["latency_ms"]
+    mem = result["memory"] or {}
+    mem_mb = mem.get("peak_delta_bytes")
+    print(f"{result['endpoint']:<24} n={result['requests']:<5} err={result['errors']:<4} "
+          f"rps={_fmt(result['rps']):>8} p50={_fmt(lat['p50']):>8} p95={_fmt(lat['p95']):>8} "
+          f"p99={_fmt(lat['p99']):>8} ms  mem+={_fmt(mem_mb / 2**20 if mem_mb is not None else None)} MiB")
+
+
+def print_comparison(report, baseline):
+    old = {r["endpoint"]: r for r in baseline["results"]}
+    print("\n" + "=" * 60)
+    print(f"COMPARISON vs {baseline.get('git_revision')} ({baseline.get('generated_at')})")
+    print("=" * 60)
+    if baseline.get("startup") and report.get("startup"):
+        import_old, import_new = baseline["startup"]["import_s"] * 1000, report["startup"]["import_s"] * 1000
+        print(f"{'startup.import':<24} {import_old:>8.0f} -> {import_new:>8.0f} ms "
+              f"({_fmt((import_new / import_old - 1) * 100, '+.1f')}%)")
+    for result in report["results"]:
+        before = old.get(result["endpoint"])
+        if not before:
+            continue
+        p95_old, p95_new = before["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        rps_old, rps_new = before["rps"], result["rps"]
+        p95_change = (p95_new / p95_old - 1) * 100 if p95_old and p95_new else None
+        rps_change = (rps_new / rps_old - 1) * 100 if rps_old and rps_new else None
+        print(f"{result['endpoint']:<24} p95 {_fmt(p95_old):>8} -> {_fmt(p95_new):>8} ms ({_fmt(p95_change, '+.1f')}%)  "
+              f"rps {_fmt(rps_old):>8} -> {_fmt(rps_new):>8} ({_fmt(rps_change, '+.1f')}%)")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    if report is None:
+        print(f"Seeded {args.database}")
+        return 0
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nReport written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+
+    return 1 if any(r["errors"] for r in report["results"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Deterministic synthetic forest data for benchmarks
+
+Documents are shaped like the ones the API writes so they can be inserted
+straight into Mongo or fed to the kernels in kernels.py.
+"""
+import math
+import random
+import uuid
+from datetime import datetime, timedelta
+
+SPECIES = ["スギ", "ヒノキ", "アカマツ", "カラマツ", "ブナ", "ミズナラ", "ケヤキ", "クヌギ"]
+HEALTH = ["healthy", "healthy", "healthy", "warning", "critical"]
+
+# Roughly the area the sample data in the frontend uses
+ORIGIN_LAT = 35.6762
+ORIGIN_LNG = 139.6503
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def make_work_areas(n_areas, seed=0, area_size_deg=0.002):
+    """Square work areas laid out on a grid around the origin"""
+    rng = random.Random(seed)
+    per_row = max(1, math.ceil(math.sqrt(n_areas)))
+    now = datetime.utcnow()
+    areas = []
+    for i in range(n_areas):
+        lat0 = ORIGIN_LAT + (i // per_row) * area_size_deg
+        lng0 = ORIGIN_LNG + (i % per_row) * area_size_deg
+        areas.append({
+            "name": f"エリア{i + 1}",
+            "status": rng.choice(["active", "maintenance", "completed"]),
+            "boundary": [
+                [lat0, lng0],
+                [lat0 + area_size_deg, lng0],
+                [lat0 + area_size_deg, lng0 + area_size_deg],
+                [lat0, lng0 + area_size_deg],
+            ],
+            "description": "",
+            "id": _uuid(rng),
+            "created_at": now,
+            "updated_at": now,
+            "tree_count": 0,
+            "last_visit": now.isoformat(),
+        })
+    return areas
+
+
+def make_traced_boundary(n_vertices, seed=0, radius_deg=0.003, jitter=0.002):
+    """A hand-traced-looking boundary: a noisy circle with a closing vertex"""
+    rng = random.Random(seed)
+    boundary = []
+    for i in range(n_vertices):
+        angle = 2 * math.pi * i / n_vertices
+        r = radius_deg * (1 + rng.uniform(-jitter, jitter))
+        boundary.append([ORIGIN_LAT + r * math.sin(angle), ORIGIN_LNG + r * math.cos(angle)])
+    return [*boundary, boundary[0]]
+
+
+def make_trees(n_trees, areas=None, seed=0):
+    """Trees scattered uniformly inside the given work areas"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    trees = []
+    for i in range(n_trees):
+        if areas:
+            area = areas[i % len(areas)]
+            (lat_min, lng_min), _, (lat_max, lng_max), _ = area["boundary"]
+            lat = rng.uniform(lat_min, lat_max)
+            lng = rng.uniform(lng_min, lng_max)
+            area_id = area["id"]
+        else:
+            lat = ORIGIN_LAT + rng.uniform(-0.05, 0.05)
+            lng = ORIGIN_LNG + rng.uniform(-0.05, 0.05)
+            area_id = None
+        created_at = now - timedelta(days=rng.randint(0, 5 * 365))
+        trees.append({
+            "species": rng.choice(SPECIES),
+            "health": rng.choice(HEALTH),
+            "lat": lat,
+            "lng": lng,
+            "diameter": round(rng.uniform(8, 80), 1),
+            "height": round(rng.uniform(3, 35), 1),
+            "notes": "",
+            "area_id": area_id,
+            "id": _uuid(rng),
+            "created_at": created_at,
+            "updated_at": created_at,
+            "photos": [],
+            "last_check": created_at.isoformat(),
+            "location": {"type": "Point", "coordinates": [lng, lat]},
+        })
+    return trees
+
+
+def make_track_points(n_points, seed=0, step_m=3.0):
+    """A random walk of {lat, lng, timestamp} points with ~step_m spacing"""
+    rng = random.Random(seed)
+    step_deg = step_m / 111_320
+    lat, lng = ORIGIN_LAT, ORIGIN_LNG
+    heading = rng.uniform(0, 2 * math.pi)
+    start = datetime.utcnow()
+    points = []
+    for i in range(n_points):
+        heading += rng.gauss(0, 0.3)
+        lat += step_deg * math.cos(heading)
+        lng += step_deg * math.sin(heading) / math.cos(math.radians(lat))
+        points.append({
+            "lat": lat,
+            "lng": lng,
+            "timestamp": (start + timedelta(seconds=i)).isoformat(),
+        })
+    return points
+
+
+def make_gps_tracks(n_tracks, points_per_track, seed=0):
+    rng = random.Random(seed)
+    tracks = []
+    for i in range(n_tracks):
+        tracks.append({
+            "name": f"軌跡{i + 1}",
+            "points": make_track_points(points_per_track, seed=seed + i),
+            "track_type": "path",
+            "id": _uuid(rng),
+            "created_at": datetime.utcnow(),
+            "distance": 0,
+        })
+    return tracks
@@ -0,0 +1,119 @@
+"""
+Micro-benchmarks for the CPU paths behind the API handlers
+
+    pip install -r benchmarks/requirements.txt
+    pytest benchmarks/test_kernels.py --benchmark-autosave
+    # later, fail if any kernel's mean got >15% slower than the saved run
+    pytest benchmarks/test_kernels.py --benchmark-compare --benchmark-compare-fail=mean:15%
+
+Each case also has an absolute budget (seconds, scaled by BENCH_BUDGET_SCALE)
+that catches order-of-magnitude regressions without a saved baseline.
+"""
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from bson import ObjectId  # noqa: E402
+
+import boundaries  # noqa: E402
+import kernels  # noqa: E402
+from benchmarks import synthetic  # noqa: E402
+
+# Per-item budgets in seconds; the case budget is items * per_item + fixed
+TRACK_PER_POINT = 250e-6
+SERIALIZE_PER_DOC = 5e-6
+ENCODE_PER_TREE = 30e-6
+CSV_PER_TREE = 50e-6
+JSON_PER_TREE = 100e-6
+EXPORT_FIXED = 0.5
+REPORT_BUDGET = 3.0
+BOUNDARY_PER_VERTEX = 20e-6
+BOUNDARY_FIXED = 0.05
+
+SCALES = [1_000, 10_000, 100_000]
+
+
+def _with_object_ids(docs):
+    return [{**doc, "_id": ObjectId()} for doc in docs]
+
+
+@pytest.mark.parametrize("n_points", SCALES)
+def test_track_distance(benchmark, within_budget, n_points):
+    points = synthetic.make_track_points(n_points, seed=1)
+    distance = benchmark(kernels.track_distance, points)
+    assert distance > 0
+    within_budget(n_points * TRACK_PER_POINT)
+
+
+@pytest.mark.parametrize("n_docs", SCALES)
+def test_serialize_docs(benchmark, within_budget, n_docs):
+    trees = synthetic.make_trees(n_docs, seed=1)
+
+    # serialize_docs mutates in place, so every round gets fresh ObjectIds
+    result = benchmark.pedantic(
+        kernels.serialize_docs,
+        setup=lambda: ((_with_object_ids(trees),), {}),
+        rounds=10,
+    )
+    assert isinstance(result[0]["_id"], str)
+    within_budget(n_docs * SERIALIZE_PER_DOC)
+
+
+@pytest.mark.parametrize("n_trees", SCALES)
+def test_encode_json(benchmark, within_budget, n_trees):
+    trees = kernels.serialize_docs(_with_object_ids(synthetic.make_trees(n_trees, seed=1)))
+    data = benchmark(kernels.encode_json, trees)
+    assert data.startswith(b"[{")
+    within_budget(n_trees * ENCODE_PER_TREE)
+
+
+@pytest.mark.parametrize("n_trees", SCALES)
+def test_write_csv_export(benchmark, within_budget, tmp_path, n_trees):
+    trees = synthetic.make_trees(n_trees, seed=1)
+    file_path = tmp_path / "export.csv"
+    benchmark.pedantic(kernels.write_csv_export, args=(str(file_path), trees), rounds=3)
+    assert file_path.stat().st_size > 0
+    within_budget(EXPORT_FIXED + n_trees * CSV_PER_TREE)
+
+
+@pytest.mark.parametrize("n_trees", SCALES)
+def test_write_json_export(benchmark, within_budget, tmp_path, n_trees):
+    areas = synthetic.make_work_areas(max(1, n_trees // 1000), seed=1)
+    export_data = {
+        "trees": synthetic.make_trees(n_trees, areas=areas, seed=1),
+        "work_areas": areas,
+        "gps_tracks": synthetic.make_gps_tracks(5, 1000, seed=1),
+        "exported_at": datetime.utcnow().isoformat(),
+    }
+    file_path = tmp_path / "export.json"
+    benchmark.pedantic(kernels.write_json_export, args=(str(file_path), export_data), rounds=3)
+    assert file_path.stat().st_size > 0
+    within_budget(EXPORT_FIXED + n_trees * JSON_PER_TREE)
+
+
+@pytest.mark.parametrize("report_type", ["summary", "full"])
+def test_build_report_pdf(benchmark, within_budget, tmp_path, report_type):
+    analytics = {
+        "total_trees": 100000, "healthy_trees": 60000, "warning_trees": 30000,
+        "critical_trees": 10000, "total_areas": 100, "total_tracks": 20,
+    }
+    trees = synthetic.make_trees(1000, seed=1) if report_type == "full" else None
+    file_path = tmp_path / "report.pdf"
+    benchmark.pedantic(
+        kernels.build_report_pdf,
+        args=(str(file_path), datetime.now(), analytics, trees),
+        rounds=5,
+    )
+    assert file_path.stat().st_size > 0
+    within_budget(REPORT_BUDGET)
+
+
+@pytest.mark.parametrize("n_vertices", SCALES)
+def test_boundary_fields(benchmark, within_budget, n_vertices):
+    boundary = synthetic.make_traced_boundary(n_vertices, seed=1)
+    fields = benchmark(boundaries.derived_fields, boundary)
+    assert fields["vertex_count"] == n_vertices
+    assert len(fields["boundary_lod"]["low"]) < n_vertices
+    within_budget(BOUNDARY_FIXED + n_vertices * BOUNDARY_PER_VERTEX)
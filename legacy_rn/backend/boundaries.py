@@ -0,0 +1,87 @@
+"""Validated work area boundaries and their precomputed geometry
+
+Boundaries are repaired on write (geometry.repair_ring) and stored with
+bbox, area_ha, centroid, vertex_count and simplified levels of detail in
+`boundary_lod`, so area lists ship a few dozen vertices per area instead
+of the hand-traced original, viewport queries filter on the stored bbox
+and stand metrics never recompute areas.
+"""
+import logging
+import os
+
+import executor
+import geometry
+
+# Douglas-Peucker tolerance in meters per level of detail
+BOUNDARY_LODS = {"high": 1.0, "medium": 5.0, "low": 25.0}
+WORK_AREA_LIST_DETAIL = os.getenv("WORK_AREA_LIST_DETAIL", "medium")
+DETAILS = ["full", *BOUNDARY_LODS, "bbox"]
+
+logger = logging.getLogger("boundaries")
+
+
+def derived_fields(boundary):
+    """Repaired boundary plus the stored derivatives; raises ValueError if invalid
+
+    An empty boundary is accepted: the app creates areas before anyone has
+    traced them, and they are stored without bbox or centroid.
+    """
+    if not boundary:
+        return {"boundary": [], "vertex_count": 0, "area_ha": 0.0,
+                "boundary_lod": {name: [] for name in BOUNDARY_LODS}}
+    ring = geometry.repair_ring(boundary)
+    min_lat, min_lng, max_lat, max_lng = geometry.bbox(ring)
+    return {
+        "boundary": ring.tolist(),
+        "vertex_count": len(ring),
+        "bbox": {"min_lat": min_lat, "min_lng": min_lng, "max_lat": max_lat, "max_lng": max_lng},
+        "area_ha": float(geometry.polygon_areas_ha([ring])[0]),
+        "centroid": geometry.centroid(ring),
+        "boundary_lod": {name: geometry.simplify(ring, tolerance).tolist()
+                         for name, tolerance in BOUNDARY_LODS.items()},
+    }
+
+
+def _legacy_fields(boundary):
+    """Fields for a stored boundary that cannot be repaired, kept as is"""
+    try:
+        return derived_fields(boundary)
+    except ValueError as e:
+        try:
+            area_ha = float(geometry.polygon_areas_ha([boundary])[0])
+        except (ValueError, TypeError, IndexError):
+            area_ha = 0.0
+        return {
+            "vertex_count": len(boundary),
+            "area_ha": area_ha,
+            "boundary_lod": {name: boundary for name in BOUNDARY_LODS},
+            "boundary_error": str(e),
+        }
+
+
+def list_projection(detail):
+    """Projection that leaves out the boundary versions `detail` doesn't need"""
+    if detail == "full":
+        return {"boundary_lod": 0}
+    return {"boundary": 0, **{f"boundary_lod.{name}": 0 for name in BOUNDARY_LODS if name != detail}}
+
+
+def apply_detail(area, detail):
+    """Put the requested level of detail in `boundary`"""
+    lods = area.pop("boundary_lod", None) or {}
+    if detail in BOUNDARY_LODS:
+        area["boundary"] = lods.get(detail)
+    return area
+
+
+async def ensure_indexes(db):
+    await db.work_areas.create_index([("org_id", 1), ("bbox.min_lat", 1), ("bbox.max_lat", 1)])
+
+
+async def backfill(db):
+    """Validate and precompute geometry for areas stored before it existed"""
+    async for area in db.work_areas.find({"boundary_lod": {"$exists": False}}, {"id": 1, "boundary": 1}):
+        fields = await executor.run_blocking(_legacy_fields, area.get("boundary") or [])
+        if "boundary_error" in fields:
+            logger.warning("Work area %s has an invalid boundary: %s", area.get("id"), fields["boundary_error"])
+        await db.work_areas.update_one({"_id": area["_id"]}, {"$set": fields})
@@ -0,0 +1,50 @@
+"""Managed executor for CPU and disk heavy work
+
+Handlers await `run_blocking(func, *args)` instead of calling kernels
+directly so that one large export or report does not stall every other
+request served by the same worker.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# "thread" keeps everything in-process (cheap, fine for I/O and code that
+# releases the GIL); "process" gives true parallelism for pure-Python loops.
+CPU_EXECUTOR = os.getenv("CPU_EXECUTOR", "thread")
+# Defaults to an even share of the cores across WEB_CONCURRENCY workers
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0")) or max(
+    1, min(4, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1")))
+)
+
+_executor = None
+
+
+def start():
+    global _executor
+    if _executor is not None:
+        return _executor
+    if CPU_EXECUTOR == "process":
+        _executor = ProcessPoolExecutor(max_workers=CPU_WORKERS)
+    elif CPU_EXECUTOR == "thread":
+        _executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+    else:
+        raise ValueError(f"Unknown CPU_EXECUTOR: {CPU_EXECUTOR}")
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run `func(*args, **kwargs)` on the managed pool and await its result
+
+    With CPU_EXECUTOR=process, `func` and its arguments must be picklable, so
+    pass module-level functions from kernels.py.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(start(), functools.partial(func, *args, **kwargs))
@@ -0,0 +1,239 @@
+"""Vectorized planar geometry on [lat, lng] rings
+
+Work area boundaries are lists of [lat, lng] pairs (Leaflet order). Areas
+are computed on a local equirectangular projection around each ring's
+mean latitude, which is accurate to well under 1% at stand scale.
+Rings are stored open (the first vertex is not repeated at the end).
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+# Points closer than this to an edge touch it
+TOUCH_TOLERANCE_M = 1e-6
+
+
+def _project(lat, lng, lat0):
+    """Degrees to local planar meters around latitude lat0"""
+    x = np.radians(lng) * EARTH_RADIUS_M * np.cos(np.radians(lat0))
+    y = np.radians(lat) * EARTH_RADIUS_M
+    return x, y
+
+
+def _ring_xy(ring):
+    """Planar meters relative to the ring's first vertex, plus the projection latitude"""
+    lat0 = ring[:, 0].mean()
+    x, y = _project(ring[:, 0] - ring[0, 0], ring[:, 1] - ring[0, 1], lat0)
+    return x, y, lat0
+
+
+def _signed_area(x, y):
+    """Shoelace area in m², positive for counter-clockwise rings (x east, y north)"""
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y)) / 2
+
+
+def polygon_areas_ha(boundaries):
+    """Areas in hectares of many rings in one vectorized pass
+
+    Rings with fewer than 3 vertices get an area of 0.
+    """
+    sizes = np.array([len(ring) for ring in boundaries], dtype=np.int64)
+    areas = np.zeros(len(boundaries))
+    valid = np.flatnonzero(sizes >= 3)
+    if valid.size == 0:
+        return areas
+
+    points = np.array([point[:2] for i in valid for point in boundaries[i]], dtype=float)
+    lat, lng = points[:, 0], points[:, 1]
+    valid_sizes = sizes[valid]
+    starts = np.concatenate(([0], np.cumsum(valid_sizes)[:-1]))
+
+    # Each ring is projected around its own mean latitude
+    ring_index = np.repeat(np.arange(valid.size), valid_sizes)
+    lat0 = np.bincount(ring_index, weights=lat) / valid_sizes
+    x, y = _project(lat, lng, lat0[ring_index])
+
+    # Index of the next vertex, wrapping to the ring's first vertex
+    nxt = np.arange(lat.size) + 1
+    nxt[starts + valid_sizes - 1] = starts
+
+    cross = x * y[nxt] - x[nxt] * y
+    areas[valid] = np.abs(np.add.reduceat(cross, starts)) / 2 / 10_000
+    return areas
+
+
+def bbox(boundary):
+    """(min_lat, min_lng, max_lat, max_lng) of a ring"""
+    points = np.asarray(boundary, dtype=float)[:, :2]
+    min_lat, min_lng = points.min(axis=0)
+    max_lat, max_lng = points.max(axis=0)
+    return float(min_lat), float(min_lng), float(max_lat), float(max_lng)
+
+
+def points_in_polygon(lats, lngs, boundary):
+    """Boolean mask of the points inside the ring (even-odd rule)"""
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    ring = np.asarray(boundary, dtype=float)[:, :2]
+    inside = np.zeros(lats.shape, dtype=bool)
+    lat_j, lng_j = ring[-1]
+    for lat_i, lng_i in ring:
+        crosses = (lat_i > lats) != (lat_j > lats)
+        if lat_j != lat_i:
+            edge_lng = (lng_j - lng_i) * (lats - lat_i) / (lat_j - lat_i) + lng_i
+            inside ^= crosses & (lngs < edge_lng)
+        lat_j, lng_j = lat_i, lng_i
+    return inside
+
+
+def _on_segment(d, length, px, py, west, east, south, north):
+    """Whether point p with orientation d lies on the segment of that length and bbox"""
+    t = TOUCH_TOLERANCE_M
+    return (np.abs(d) <= t * length) & (px >= west - t) & (px <= east + t) & (py >= south - t) & (py <= north + t)
+
+
+def _has_spike(x, y):
+    """Whether the ring doubles back on itself at a vertex (collinear edges in opposite directions)"""
+    ux, uy = x - np.roll(x, 1), y - np.roll(y, 1)
+    vx, vy = np.roll(x, -1) - x, np.roll(y, -1) - y
+    cross = ux * vy - uy * vx
+    return bool(np.any((np.abs(cross) <= TOUCH_TOLERANCE_M * np.hypot(ux, uy)) & (ux * vx + uy * vy < 0)))
+
+
+def _self_intersects(x, y, chunk_size=256):
+    """Whether any two non-adjacent edges of the ring cross or touch
+
+    Edges are sorted by their west end, so each chunk of chunk_size edges
+    is only compared with the edges that start before the chunk's east end;
+    pairs whose bboxes overlap get the orientation sign test, and an
+    endpoint lying on the other edge (zero orientation) counts as a touch.
+    """
+    n = x.size
+    index = np.arange(n)
+    ax, ay = x, y
+    bx, by = np.roll(x, -1), np.roll(y, -1)
+    order = np.argsort(np.minimum(ax, bx), kind="stable")
+    index, ax, ay, bx, by = index[order], ax[order], ay[order], bx[order], by[order]
+    west, east = np.minimum(ax, bx), np.maximum(ax, bx)
+    south, north = np.minimum(ay, by), np.maximum(ay, by)
+    length = np.hypot(bx - ax, by - ay)
+
+    for start in range(0, n, chunk_size):
+        rows = slice(start, min(start + chunk_size, n))
+        stop = int(np.searchsorted(west, east[rows].max(), side="right"))
+        # Candidate pairs: each pair once, bboxes overlapping
+        candidates = (np.arange(start, rows.stop)[:, None] < np.arange(start, stop)) \
+            & (west[start:stop] <= east[rows, None]) \
+            & (south[start:stop] <= north[rows, None]) & (north[start:stop] >= south[rows, None])
+        r, c = np.nonzero(candidates)
+        r += start
+        c += start
+        # ... that are not an edge and its neighbour
+        gap = np.abs(index[r] - index[c])
+        apart = (gap > 1) & (gap < n - 1)
+        r, c = r[apart], c[apart]
+        if r.size == 0:
+            continue
+        d1 = (bx[r] - ax[r]) * (ay[c] - ay[r]) - (by[r] - ay[r]) * (ax[c] - ax[r])
+        d2 = (bx[r] - ax[r]) * (by[c] - ay[r]) - (by[r] - ay[r]) * (bx[c] - ax[r])
+        d3 = (bx[c] - ax[c]) * (ay[r] - ay[c]) - (by[c] - ay[c]) * (ax[r] - ax[c])
+        d4 = (bx[c] - ax[c]) * (by[r] - ay[c]) - (by[c] - ay[c]) * (bx[r] - ax[c])
+        if np.any((d1 * d2 < 0) & (d3 * d4 < 0)):
+            return True
+        on_r = (west[r], east[r], south[r], north[r])
+        on_c = (west[c], east[c], south[c], north[c])
+        if np.any(_on_segment(d1, length[r], ax[c], ay[c], *on_r) | _on_segment(d2, length[r], bx[c], by[c], *on_r)
+                  | _on_segment(d3, length[c], ax[r], ay[r], *on_c) | _on_segment(d4, length[c], bx[r], by[r], *on_c)):
+            return True
+    return False
+
+
+def repair_ring(boundary):
+    """Open, counter-clockwise ring without repeated consecutive vertices
+
+    Drops the closing vertex and duplicate vertices and reverses clockwise
+    rings. Raises ValueError for rings that cannot be repaired: invalid
+    coordinates, fewer than 3 distinct vertices, zero area, a vertex
+    visited twice, a spike doubling back along an edge or self-intersections.
+    """
+    if any(len(point) < 2 for point in boundary):
+        raise ValueError("Boundary points must be [lat, lng]")
+    ring = np.array([point[:2] for point in boundary], dtype=float).reshape(-1, 2)
+    if not np.isfinite(ring).all() or np.any(np.abs(ring[:, 0]) > 90) or np.any(np.abs(ring[:, 1]) > 180):
+        raise ValueError("Boundary coordinates out of range")
+
+    # Comparing with the previous vertex (wrapping) also drops a closing vertex
+    ring = ring[np.any(ring != np.roll(ring, 1, axis=0), axis=1)]
+    if len(ring) < 3:
+        raise ValueError("Boundary needs at least 3 distinct points")
+
+    if len(np.unique(ring, axis=0)) < len(ring):
+        raise ValueError("Boundary passes through the same point twice")
+
+    x, y, _ = _ring_xy(ring)
+    area = _signed_area(x, y)
+    if abs(area) < 1e-6:
+        raise ValueError("Boundary has no area")
+    if _has_spike(x, y) or _self_intersects(x, y):
+        raise ValueError("Boundary intersects itself")
+    return ring[::-1] if area < 0 else ring
+
+
+def _douglas_peucker(x, y, keep, spans, tolerance):
+    """Mark in `keep` the vertices Douglas-Peucker keeps within each (start, end) span"""
+    stack = list(spans)
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+        dist = np.abs(dx * py - dy * px) / length if length else np.hypot(px, py)
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.extend([(start, split), (split, end)])
+
+
+def simplify(ring, tolerance_m):
+    """Douglas-Peucker simplification of an open ring, at least 3 vertices
+
+    Meant for display; a simplified ring may self-intersect where the
+    original nearly touched itself.
+    """
+    ring = np.asarray(ring, dtype=float)
+    n = len(ring)
+    if n <= 3:
+        return ring
+    x, y, _ = _ring_xy(ring)
+    # Close the ring and split it at the vertex farthest from the first
+    x, y = np.append(x, x[0]), np.append(y, y[0])
+    far = int(np.argmax(np.hypot(x[:n] - x[0], y[:n] - y[0])))
+    keep = np.zeros(n + 1, dtype=bool)
+    keep[[0, far, n]] = True
+    _douglas_peucker(x, y, keep, [(0, far), (far, n)], tolerance_m)
+    keep = keep[:n]
+    if keep.sum() < 3:
+        # Everything is within tolerance of the first-farthest chord
+        dx, dy = x[far] - x[0], y[far] - y[0]
+        dist = np.abs(dx * (y[:n] - y[0]) - dy * (x[:n] - x[0]))
+        dist[keep] = -1
+        keep[int(np.argmax(dist))] = True
+    return ring[keep]
+
+
+def centroid(ring):
+    """[lat, lng] area centroid of a ring"""
+    ring = np.asarray(ring, dtype=float)
+    x, y, lat0 = _ring_xy(ring)
+    x1, y1 = np.roll(x, -1), np.roll(y, -1)
+    cross = x * y1 - x1 * y
+    area = cross.sum() / 2
+    if area == 0:
+        return [float(ring[:, 0].mean()), float(ring[:, 1].mean())]
+    cx = ((x + x1) * cross).sum() / (6 * area)
+    cy = ((y + y1) * cross).sum() / (6 * area)
+    lat = ring[0, 0] + np.degrees(cy / EARTH_RADIUS_M)
+    lng = ring[0, 1] + np.degrees(cx / (EARTH_RADIUS_M * np.cos(np.radians(lat0))))
+    return [float(lat), float(lng)]
@@ -0,0 +1,332 @@
+"""Tree density and health rasters
+
+Trees inside a bounding box are streamed from Mongo in cursor chunks and
+binned into a grid with np.bincount, so a heatmap over a million trees is
+a few hundred kilobytes of raster instead of a million points.
+
+Two layouts are supported:
+- an arbitrary lat/lng bbox with a cell size in meters
+- Web Mercator XYZ tiles (256 x 256 px), built as a pyramid: tiles at
+  HEATMAP_PYRAMID_ZOOM and deeper are binned from the trees in them, and
+  each tile above it is summed from the cell grids of its four children.
+
+Every tile up to HEATMAP_PYRAMID_ZOOM has its own revision counter, which
+tree writes bump for the tile containing the tree at every such zoom
+(`tile_revisions`); deeper tiles use the counter of their ancestor at that
+zoom. PNGs and cell grids are cached under these counters, so after a
+field edit only the tiles on the path to it are rebuilt, and the low-zoom
+ones from three cached children and one rebuilt child instead of a rescan
+of every tree below them. Revisions and trees are read in one causally
+consistent session, so a lagging secondary cannot put old data under a new
+revision.
+"""
+import functools
+import io
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import executor
+import mongo
+import revisions
+
+HEATMAP_MAX_CELLS = int(os.getenv("HEATMAP_MAX_CELLS", "4000000"))
+HEATMAP_CHUNK_SIZE = int(os.getenv("HEATMAP_CHUNK_SIZE", "50000"))
+HEATMAP_TILE_CACHE_BYTES = int(os.getenv("HEATMAP_TILE_CACHE_MB", "64")) * 2**20
+HEATMAP_GRID_CACHE_BYTES = int(os.getenv("HEATMAP_GRID_CACHE_MB", "128")) * 2**20
+HEATMAP_PYRAMID_ZOOM = int(os.getenv("HEATMAP_PYRAMID_ZOOM", "12"))
+
+TILE_SIZE = 256
+METRICS = ("density", "health")
+HEALTH_SCORES = {"healthy": 0.0, "warning": 1.0, "critical": 2.0}
+
+METERS_PER_DEGREE = 111_320
+
+# Color ramps as (position, r, g, b) stops
+DENSITY_RAMP = [(0.0, 255, 255, 178), (0.25, 254, 204, 92), (0.5, 253, 141, 60), (0.75, 240, 59, 32), (1.0, 189, 0, 38)]
+HEALTH_RAMP = [(0.0, 26, 152, 80), (0.5, 254, 224, 139), (1.0, 215, 48, 39)]
+
+
+class Grid:
+    """Per-cell tree count and summed health score, row 0 = north"""
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.count = np.zeros(rows * cols, dtype=np.float64)
+        self.score = np.zeros(rows * cols, dtype=np.float64)
+
+    def add(self, flat_index, scores):
+        self.count += np.bincount(flat_index, minlength=self.count.size)
+        self.score += np.bincount(flat_index, weights=scores, minlength=self.score.size)
+
+    def values(self, metric):
+        count = self.count.reshape(self.rows, self.cols)
+        if metric == "density":
+            return count.astype(np.float32)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.score.reshape(self.rows, self.cols) / count
+        return np.where(count > 0, mean, np.nan).astype(np.float32)
+
+
+def _chunk_arrays(chunk):
+    lats = np.fromiter((doc["lat"] for doc in chunk), dtype=float, count=len(chunk))
+    lngs = np.fromiter((doc["lng"] for doc in chunk), dtype=float, count=len(chunk))
+    scores = np.fromiter((HEALTH_SCORES.get(doc.get("health"), 0.0) for doc in chunk), dtype=float, count=len(chunk))
+    return lats, lngs, scores
+
+
+# The *_chunk_cells functions run on the CPU executor and return the flat
+# cell index and health score of every tree in the chunk that lands in the grid.
+
+def _bbox_chunk_cells(n_rows, n_cols, bbox, chunk):
+    min_lat, min_lng, max_lat, max_lng = bbox
+    lats, lngs, scores = _chunk_arrays(chunk)
+    rows = ((max_lat - lats) / (max_lat - min_lat) * n_rows).astype(np.int64)
+    cols = ((lngs - min_lng) / (max_lng - min_lng) * n_cols).astype(np.int64)
+    # Points exactly on the south/east edge belong to the last cell
+    rows = np.minimum(rows, n_rows - 1)
+    cols = np.minimum(cols, n_cols - 1)
+    keep = (rows >= 0) & (cols >= 0)
+    return rows[keep] * n_cols + cols[keep], scores[keep]
+
+
+def _mercator_pixels(lats, lngs, z):
+    scale = TILE_SIZE * 2 ** z
+    lat_rad = np.radians(np.clip(lats, -85.05112878, 85.05112878))
+    px = (lngs + 180.0) / 360.0 * scale
+    py = (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0 * scale
+    return px, py
+
+
+def _tile_chunk_cells(z, x, y, chunk):
+    lats, lngs, scores = _chunk_arrays(chunk)
+    px, py = _mercator_pixels(lats, lngs, z)
+    cols = np.floor(px - x * TILE_SIZE).astype(np.int64)
+    rows = np.floor(py - y * TILE_SIZE).astype(np.int64)
+    keep = (rows >= 0) & (rows < TILE_SIZE) & (cols >= 0) & (cols < TILE_SIZE)
+    return rows[keep] * TILE_SIZE + cols[keep], scores[keep]
+
+
+def tile_bbox(z, x, y):
+    """(min_lat, min_lng, max_lat, max_lng) of an XYZ tile"""
+    n = 2 ** z
+
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return lat(y + 1), x / n * 360.0 - 180.0, lat(y), (x + 1) / n * 360.0 - 180.0
+
+
+def grid_shape(bbox, cell_size_m):
+    min_lat, min_lng, max_lat, max_lng = bbox
+    mid_lat = math.radians((min_lat + max_lat) / 2)
+    lat_step = cell_size_m / METERS_PER_DEGREE
+    lng_step = cell_size_m / (METERS_PER_DEGREE * max(math.cos(mid_lat), 1e-6))
+    rows = max(1, math.ceil((max_lat - min_lat) / lat_step))
+    cols = max(1, math.ceil((max_lng - min_lng) / lng_step))
+    return rows, cols
+
+
+def _bbox_query(bbox):
+    min_lat, min_lng, max_lat, max_lng = bbox
+    return {"lat": {"$gte": min_lat, "$lte": max_lat}, "lng": {"$gte": min_lng, "$lte": max_lng}}
+
+
+async def _fill(db, grid, bbox, chunk_cells, session=None):
+    cursor = db.trees.find(
+        _bbox_query(bbox), {"_id": 0, "lat": 1, "lng": 1, "health": 1}, session=session
+    ).batch_size(HEATMAP_CHUNK_SIZE)
+
+    chunk = []
+    async for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= HEATMAP_CHUNK_SIZE:
+            grid.add(*await executor.run_blocking(chunk_cells, chunk))
+            chunk = []
+    if chunk:
+        grid.add(*await executor.run_blocking(chunk_cells, chunk))
+    return grid
+
+
+async def bbox_grid(db, bbox, cell_size_m):
+    rows, cols = grid_shape(bbox, cell_size_m)
+    if rows * cols > HEATMAP_MAX_CELLS:
+        raise ValueError(f"Grid of {rows}x{cols} cells exceeds HEATMAP_MAX_CELLS; use a larger cell_size")
+    grid = Grid(rows, cols)
+    return await _fill(db, grid, bbox, functools.partial(_bbox_chunk_cells, rows, cols, bbox))
+
+
+# Encoding
+
+def _ramp(values, stops):
+    positions = [stop[0] for stop in stops]
+    channels = [np.interp(values, positions, [stop[i] for stop in stops]) for i in (1, 2, 3)]
+    return np.stack(channels, axis=-1).astype(np.uint8)
+
+
+def encode_png(values, metric):
+    from PIL import Image
+
+    if metric == "density":
+        present = values > 0
+        peak = values.max() if present.any() else 1.0
+        # Log scale so sparse cells stay visible next to dense stands
+        scaled = np.log1p(values) / np.log1p(peak)
+        rgb = _ramp(scaled, DENSITY_RAMP)
+    else:
+        present = ~np.isnan(values)
+        rgb = _ramp(np.nan_to_num(values) / 2.0, HEALTH_RAMP)
+    alpha = np.where(present, 200, 0).astype(np.uint8)
+    image = Image.fromarray(np.dstack([rgb, alpha]), mode="RGBA")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def encode_binary(values):
+    """Row-major little-endian float32, north row first"""
+    return values.astype("<f4").tobytes()
+
+
+# Tile cache
+
+_tiles = OrderedDict()
+_tiles_bytes = 0
+
+
+def _tile_cache_put(key, data):
+    global _tiles_bytes
+    if key in _tiles:
+        _tiles_bytes -= len(_tiles.pop(key))
+    _tiles[key] = data
+    _tiles_bytes += len(data)
+    while _tiles_bytes > HEATMAP_TILE_CACHE_BYTES and _tiles:
+        _, evicted = _tiles.popitem(last=False)
+        _tiles_bytes -= len(evicted)
+
+
+# Tile pyramid
+
+def tile_revision(z, x, y):
+    """Name of the revision counter a tile is cached under"""
+    if z > HEATMAP_PYRAMID_ZOOM:
+        shift = z - HEATMAP_PYRAMID_ZOOM
+        z, x, y = HEATMAP_PYRAMID_ZOOM, x >> shift, y >> shift
+    return f"{revisions.TREES}:tile:{z}/{x}/{y}"
+
+
+def tile_revisions(trees):
+    """Counters to bump for trees written: their tile at every pyramid zoom"""
+    names = set()
+    for tree in trees:
+        lat, lng = (tree or {}).get("lat"), (tree or {}).get("lng")
+        if not isinstance(lat, (int, float)) or not isinstance(lng, (int, float)):
+            continue
+        px, py = _mercator_pixels(np.array([lat], dtype=float), np.array([lng], dtype=float),
+                                  HEATMAP_PYRAMID_ZOOM)
+        n = 2 ** HEATMAP_PYRAMID_ZOOM
+        x = min(max(int(px[0] // TILE_SIZE), 0), n - 1)
+        y = min(max(int(py[0] // TILE_SIZE), 0), n - 1)
+        for z in range(HEATMAP_PYRAMID_ZOOM + 1):
+            shift = HEATMAP_PYRAMID_ZOOM - z
+            names.add(tile_revision(z, x >> shift, y >> shift))
+    return sorted(names)
+
+
+# Cell grids are cached sparse: (flat index, count, summed score) of the non-empty cells
+
+EMPTY_CELLS = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32))
+
+
+def _sparse(grid):
+    index = np.flatnonzero(grid.count)
+    return index.astype(np.int32), grid.count[index].astype(np.float32), grid.score[index].astype(np.float32)
+
+
+def _dense(cells):
+    grid = Grid(TILE_SIZE, TILE_SIZE)
+    index, count, score = cells
+    grid.count[index] = count
+    grid.score[index] = score
+    return grid
+
+
+def _combine_children(children):
+    """Parent cells from its four children (NW, NE, SW, SE), 2x2 child cells per parent cell"""
+    half = TILE_SIZE // 2
+    indexes, counts, scores = [], [], []
+    for quadrant, (index, count, score) in enumerate(children):
+        dy, dx = divmod(quadrant, 2)
+        rows, cols = np.divmod(index.astype(np.int64), TILE_SIZE)
+        indexes.append((dy * half + rows // 2) * TILE_SIZE + dx * half + cols // 2)
+        counts.append(count)
+        scores.append(score)
+    grid = Grid(TILE_SIZE, TILE_SIZE)
+    index = np.concatenate(indexes)
+    grid.count += np.bincount(index, weights=np.concatenate(counts), minlength=grid.count.size)
+    grid.score += np.bincount(index, weights=np.concatenate(scores), minlength=grid.score.size)
+    return _sparse(grid)
+
+
+_grids = OrderedDict()
+_grids_bytes = 0
+
+
+def _cells_bytes(cells):
+    return sum(array.nbytes for array in cells)
+
+
+def _grid_cache_put(key, cells):
+    global _grids_bytes
+    if key in _grids:
+        _grids_bytes -= _cells_bytes(_grids.pop(key))
+    _grids[key] = cells
+    _grids_bytes += _cells_bytes(cells)
+    while _grids_bytes > HEATMAP_GRID_CACHE_BYTES and _grids:
+        _, evicted = _grids.popitem(last=False)
+        _grids_bytes -= _cells_bytes(evicted)
+
+
+async def _tile_cells(db, session, z, x, y, revision):
+    key = (db.org_id, revision, z, x, y)
+    if key in _grids:
+        _grids.move_to_end(key)
+        return _grids[key]
+
+    bbox = tile_bbox(z, x, y)
+    if z >= HEATMAP_PYRAMID_ZOOM:
+        grid = Grid(TILE_SIZE, TILE_SIZE)
+        await _fill(db, grid, bbox, functools.partial(_tile_chunk_cells, z, x, y), session)
+        cells = _sparse(grid)
+    elif not await db.trees.find_one(_bbox_query(bbox), {"_id": 1}, session=session):
+        # Empty subtrees are not descended into
+        cells = EMPTY_CELLS
+    else:
+        children = [(z + 1, 2 * x + dx, 2 * y + dy) for dy in (0, 1) for dx in (0, 1)]
+        child_revisions = await revisions.current(
+            db, *(tile_revision(*child) for child in children), session=session
+        )
+        parts = [await _tile_cells(db, session, *child, revision)
+                 for child, revision in zip(children, child_revisions)]
+        cells = await executor.run_blocking(_combine_children, parts)
+    if z <= HEATMAP_PYRAMID_ZOOM:
+        # Deeper tiles are not parents of anything; their PNG cache is enough
+        _grid_cache_put(key, cells)
+    return cells
+
+
+async def tile_png(db, metric, z, x, y):
+    async with await mongo.causal_session() as session:
+        revision, = await revisions.current(db, tile_revision(z, x, y), session=session)
+        key = (db.org_id, revision, metric, z, x, y)
+        if key in _tiles:
+            _tiles.move_to_end(key)
+            return _tiles[key]
+
+        cells = await _tile_cells(db, session, z, x, y, revision)
+    data = await executor.run_blocking(encode_png, _dense(cells).values(metric), metric)
+    _tile_cache_put(key, data)
+    return data
@@ -0,0 +1,104 @@
+"""Idempotency keys for create endpoints
+
+Clients on flaky connections retry creates whose response they never saw.
+When such a request carries an `Idempotency-Key` header, the first one
+claims the key in `idempotency_keys` and stores its response there;
+retries with the same key and body get that response back instead of
+writing a duplicate document. Keys expire after IDEMPOTENCY_TTL_HOURS.
+A claim whose request died without releasing it (worker crash) can be
+taken over by a retry once IDEMPOTENCY_LEASE_SECONDS have passed.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+import tenancy
+
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+
+
+class KeyReused(Exception):
+    """The key was already used for a request with a different body"""
+
+
+class KeyInProgress(Exception):
+    """The first request with this key has not finished yet"""
+
+
+async def ensure_indexes(db):
+    # Each key stores its own expiry, so changing IDEMPOTENCY_TTL_HOURS needs no index change
+    await db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+    try:
+        await db.idempotency_keys.drop_index("created_at_1")
+    except OperationFailure:
+        pass  # already dropped
+
+
+async def backfill_expiry(db):
+    """expires_at for keys written before it existed"""
+    await db.idempotency_keys.update_many(
+        {"expires_at": {"$exists": False}},
+        [{"$set": {"expires_at": {"$add": ["$created_at", IDEMPOTENCY_TTL_HOURS * 3600 * 1000]}}}],
+    )
+
+
+def fingerprint(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def run(db, scope, key, payload, create):
+    """Return `await create()` once per (scope, key); retries get the stored response
+
+    If create() raises or is cancelled, the key is released so the client
+    can retry.
+    """
+    record_id = tenancy.scoped_id(db, f"{scope}:{key}")
+    digest = fingerprint(payload)
+    while True:
+        now = datetime.utcnow()
+        # Millisecond precision, as Mongo stores it, so the release below matches
+        claimed_at = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": record_id,
+                "fingerprint": digest,
+                "state": "pending",
+                "created_at": claimed_at,
+                "claimed_at": claimed_at,
+                "expires_at": claimed_at + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+            })
+            break
+        except DuplicateKeyError:
+            record = await db.idempotency_keys.find_one({"_id": record_id})
+            if record is None:
+                continue  # expired or released in between
+            if record["fingerprint"] != digest:
+                raise KeyReused("Idempotency-Key was already used with a different request")
+            if record["state"] == "done":
+                return record["response"]
+            stale = claimed_at - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+            if record.get("claimed_at", record["created_at"]) >= stale:
+                raise KeyInProgress("A request with this Idempotency-Key is still in progress")
+            # The claiming request died; take the claim over unless another retry just did
+            taken = await db.idempotency_keys.find_one_and_update(
+                {"_id": record_id, "state": "pending", "claimed_at": record.get("claimed_at")},
+                {"$set": {"claimed_at": claimed_at}},
+            )
+            if taken is not None:
+                break
+
+    try:
+        response = await create()
+    except BaseException:
+        # Shielded so a cancelled request still releases its claim
+        await asyncio.shield(db.idempotency_keys.delete_one({"_id": record_id, "claimed_at": claimed_at}))
+        raise
+    await db.idempotency_keys.update_one(
+        {"_id": record_id}, {"$set": {"state": "done", "response": response}}
+    )
+    return response
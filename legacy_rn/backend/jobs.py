@@ -0,0 +1,135 @@
+"""Maintenance and precomputation jobs registered with the scheduler"""
+import logging
+import os
+import time
+
+import boundaries
+import executor
+import idempotency
+import mongo
+import observations
+import proximity
+import resumable
+import rollups
+import stands
+import tenancy
+import vector_layers
+
+ROLLUP_RECONCILE_INTERVAL = int(os.getenv("ROLLUP_RECONCILE_INTERVAL", "3600"))
+CACHE_WARM_INTERVAL = int(os.getenv("CACHE_WARM_INTERVAL", "300"))
+FILE_EVICTION_INTERVAL = int(os.getenv("FILE_EVICTION_INTERVAL", "600"))
+INDEX_MAINTENANCE_INTERVAL = int(os.getenv("INDEX_MAINTENANCE_INTERVAL", "86400"))
+
+# Generated report/export files in uploads/ (photos are never evicted)
+UPLOADS_DIR = "uploads"
+GENERATED_FILE_PREFIXES = ("report_", "forest_data_")
+GENERATED_FILE_MAX_AGE_HOURS = float(os.getenv("GENERATED_FILE_MAX_AGE_HOURS", "24"))
+GENERATED_FILE_QUOTA_MB = float(os.getenv("GENERATED_FILE_QUOTA_MB", "500"))
+# Files this recent may still be streaming to the client that requested them
+GENERATED_FILE_GRACE_SECONDS = 300
+
+logger = logging.getLogger("jobs")
+
+
+async def reconcile_rollups():
+    """Rebuild analytics rollups from trees (also the first build on old databases)"""
+    for org_id in await tenancy.organizations():
+        await rollups.reconcile(tenancy.db_for(org_id))
+
+
+async def warm_caches():
+    """Precompute the all-areas stand metrics so dashboards hit a warm cache"""
+    for org_id in await tenancy.organizations():
+        await stands.area_stand_metrics(tenancy.db_for(org_id, analytics=True))
+
+
+async def ensure_database(database):
+    """Create or recreate one database's indexes and the time-series collection
+
+    Cheap when they exist, so every worker runs it at startup; data
+    backfills, which scale with the inventory, are in backfill_database.
+    """
+    await mongo.ensure_indexes(database)
+    await observations.ensure_collection(database)
+    await vector_layers.ensure_indexes(database)
+    await proximity.ensure_location_index(database)
+    await idempotency.ensure_indexes(database)
+    await resumable.ensure_indexes(database)
+    await boundaries.ensure_indexes(database)
+
+
+async def ensure_indexes():
+    """ensure_database for every database (also at startup)"""
+    for database in await tenancy.databases():
+        await ensure_database(database)
+
+
+async def backfill_database(database):
+    """Idempotent backfills of documents written before a field existed"""
+    await tenancy.backfill_org_ids(database)
+    await proximity.backfill_locations(database)
+    await idempotency.backfill_expiry(database)
+    await boundaries.backfill(database)
+
+
+async def run_backfills():
+    """backfill_database for every database (leader only, so once per deployment)"""
+    for database in await tenancy.databases():
+        await backfill_database(database)
+
+
+async def migrate_vector_layers():
+    """Split layers with embedded features into vector_features (leader only, so once)"""
+    for database in await tenancy.databases():
+        await vector_layers.migrate_embedded_layers(database)
+
+
+def _generated_files():
+    files = []
+    for entry in os.scandir(UPLOADS_DIR):
+        if entry.is_file() and entry.name.startswith(GENERATED_FILE_PREFIXES):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    return sorted(files)
+
+
+def evict_generated_files_sync(max_age_hours=GENERATED_FILE_MAX_AGE_HOURS, quota_mb=GENERATED_FILE_QUOTA_MB):
+    """Delete generated files older than max_age, then oldest-first down to the quota
+
+    Returns (files_deleted, bytes_freed).
+    """
+    now = time.time()
+    cutoff = now - max_age_hours * 3600
+    quota = quota_mb * 2**20
+    files = _generated_files()
+    total = sum(size for _, size, _ in files)
+    deleted = freed = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and (total <= quota or mtime > now - GENERATED_FILE_GRACE_SECONDS):
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # removed by another worker
+        total -= size
+        deleted += 1
+        freed += size
+    if deleted:
+        logger.info("Evicted %d generated files (%.1f MB)", deleted, freed / 2**20)
+    return deleted, freed
+
+
+async def evict_generated_files():
+    """Old report/export files and part files of abandoned resumable uploads"""
+    await executor.run_blocking(evict_generated_files_sync)
+    await executor.run_blocking(resumable.evict_stale_parts_sync)
+
+
+def register(scheduler):
+    scheduler.add_job("rollup_reconciliation", ROLLUP_RECONCILE_INTERVAL, reconcile_rollups, run_at_start=True)
+    scheduler.add_job("index_maintenance", INDEX_MAINTENANCE_INTERVAL, ensure_indexes)
+    scheduler.add_job("data_backfill", INDEX_MAINTENANCE_INTERVAL, run_backfills, run_at_start=True)
+    scheduler.add_job("vector_layer_migration", INDEX_MAINTENANCE_INTERVAL, migrate_vector_layers, run_at_start=True)
+    # Per-process caches and per-host files: every worker runs these
+    scheduler.add_job("cache_warming", CACHE_WARM_INTERVAL, warm_caches, leader_only=False, run_at_start=True)
+    scheduler.add_job("generated_file_eviction", FILE_EVICTION_INTERVAL, evict_generated_files, leader_only=False)
@@ -0,0 +1,153 @@
+"""CPU and disk bound workloads used by the API handlers.
+
+Everything in this module is synchronous and free of event loop or database
+state so it can be dispatched to the thread/process pool in executor.py.
+
+geopy, pandas and reportlab are imported by the functions that need them,
+so they load on the first track, export or report instead of slowing every
+worker's startup.
+"""
+import json
+from datetime import date, datetime
+
+
+def serialize_doc(doc):
+    """Convert MongoDB document to JSON serializable format"""
+    if doc is None:
+        return None
+    doc["_id"] = str(doc["_id"])
+    return doc
+
+
+def serialize_docs(docs):
+    """Convert list of MongoDB documents to JSON serializable format"""
+    return [serialize_doc(doc) for doc in docs]
+
+
+def _json_default(value):
+    # Datetimes are most of what Mongo documents add to plain JSON
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    from fastapi.encoders import jsonable_encoder
+
+    return jsonable_encoder(value)
+
+
+def encode_json(content):
+    """UTF-8 JSON bytes identical to what FastAPI's default response renders"""
+    return json.dumps(
+        content, default=_json_default, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def track_distance(points):
+    """Total geodesic length in meters of a list of {lat, lng} points"""
+    from geopy.distance import geodesic
+
+    total_distance = 0
+    for i in range(1, len(points)):
+        p1 = points[i-1]
+        p2 = points[i]
+        total_distance += geodesic((p1["lat"], p1["lng"]), (p2["lat"], p2["lng"])).meters
+    return total_distance
+
+
+def write_json_export(file_path, export_data):
+    """Write the export payload as pretty-printed JSON"""
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(export_data, f, ensure_ascii=False, indent=2, default=_json_default)
+
+
+def write_csv_export(file_path, trees):
+    """Write the tree list as CSV, dropping nested fields"""
+    import pandas as pd
+
+    df = pd.DataFrame(trees)
+    if not df.empty:
+        # Remove complex fields for CSV
+        df = df.drop(columns=["photos", "location"], errors="ignore")
+
+    df.to_csv(file_path, index=False, encoding='utf-8-sig')
+
+
+def _table_style(header_font_size):
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), header_font_size),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+
+
+def build_report_pdf(file_path, generated_at, analytics=None, trees=None):
+    """Render the forest report PDF
+
+    `analytics` is the summary dict from /api/analytics/summary and `trees` a
+    list of serialized tree documents; either section is omitted when None.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+
+    doc = SimpleDocTemplate(file_path, pagesize=A4)
+    story = []
+    styles = getSampleStyleSheet()
+
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30,
+        alignment=1  # Center alignment
+    )
+    story.append(Paragraph("森林管理レポート", title_style))
+    story.append(Spacer(1, 12))
+
+    if analytics is not None:
+        data = [
+            ["項目", "値"],
+            ["総樹木数", str(analytics["total_trees"])],
+            ["健康な樹木", str(analytics["healthy_trees"])],
+            ["要注意樹木", str(analytics["warning_trees"])],
+            ["作業エリア数", str(analytics["total_areas"])],
+            ["GPS軌跡数", str(analytics["total_tracks"])],
+        ]
+
+        table = Table(data)
+        table.setStyle(_table_style(14))
+
+        story.append(Paragraph("概要統計", styles['Heading2']))
+        story.append(table)
+        story.append(Spacer(1, 12))
+
+    if trees:
+        story.append(Paragraph("樹木一覧", styles['Heading2']))
+        tree_data = [["ID", "樹種", "健康状態", "直径(cm)", "高さ(m)"]]
+
+        for tree in trees[:20]:  # Limit to 20 trees for PDF
+            tree_data.append([
+                tree.get("id", "")[:8],
+                tree.get("species", ""),
+                tree.get("health", ""),
+                str(tree.get("diameter", 0)),
+                str(tree.get("height", 0))
+            ])
+
+        tree_table = Table(tree_data)
+        tree_table.setStyle(_table_style(10))
+
+        story.append(tree_table)
+
+    # Generate timestamp
+    story.append(Spacer(1, 20))
+    story.append(Paragraph(f"生成日時: {generated_at.strftime('%Y年%m月%d日 %H:%M:%S')}", styles['Normal']))
+
+    doc.build(story)
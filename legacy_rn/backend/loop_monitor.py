@@ -0,0 +1,73 @@
+"""Debug detector for coroutine steps that block the event loop
+
+A watchdog thread schedules a heartbeat on the loop every few milliseconds.
+If the heartbeat has not run for longer than the threshold, the loop thread
+is stuck inside a single step and its current stack is logged.
+
+Enable with LOOP_DEBUG=1; tune with LOOP_BLOCK_THRESHOLD_MS.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+LOOP_DEBUG = os.getenv("LOOP_DEBUG", "0").lower() in ("1", "true", "yes")
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+
+logger = logging.getLogger("loop_monitor")
+
+
+class LoopBlockMonitor:
+    def __init__(self, loop, threshold_ms=LOOP_BLOCK_THRESHOLD_MS):
+        self.loop = loop
+        self.threshold = threshold_ms / 1000
+        self.interval = min(self.threshold / 4, 0.05)
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+
+    def start(self):
+        # Enables asyncio's own slow-callback logging as well, which names
+        # the offending task once the blocking step finally returns.
+        self.loop.set_debug(True)
+        self.loop.slow_callback_duration = self.threshold
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _beat(self):
+        self._last_beat = time.monotonic()
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            try:
+                self.loop.call_soon_threadsafe(self._beat)
+            except RuntimeError:
+                return  # loop closed
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat
+            # Report each stall once, while it is still in progress
+            if blocked_for > self.threshold and reported_beat != last_beat:
+                reported_beat = last_beat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+                logger.warning(
+                    "Event loop blocked for %.0f ms (threshold %.0f ms); loop thread stack:\n%s",
+                    blocked_for * 1000, self.threshold * 1000, stack,
+                )
+
+
+def start_monitor():
+    """Start the detector on the running loop when LOOP_DEBUG is enabled"""
+    if not LOOP_DEBUG:
+        return None
+    monitor = LoopBlockMonitor(asyncio.get_running_loop())
+    monitor.start()
+    return monitor
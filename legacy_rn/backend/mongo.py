@@ -0,0 +1,94 @@
+"""MongoDB connection management
+
+The client is created per process from the FastAPI lifespan (see
+server.py), so every uvicorn worker gets its own connection pool. With
+WEB_CONCURRENCY workers the server opens at most
+WEB_CONCURRENCY * MONGO_MAX_POOL_SIZE connections.
+"""
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReadPreference
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "forest_management")
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0")) or None
+
+# Read preference for analytics, report and export queries. These tolerate
+# slightly stale data, so by default they are served by secondaries when the
+# deployment is a replica set (and by the primary otherwise).
+ANALYTICS_READ_PREFERENCE = os.getenv("ANALYTICS_READ_PREFERENCE", "secondaryPreferred")
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+client = None
+db = None
+analytics_db = None
+
+
+def causal_session():
+    """Session whose reads see at least what its earlier reads saw
+
+    Reads routed to different secondaries (ANALYTICS_READ_PREFERENCE) can
+    otherwise go back in time, e.g. data older than the revision just read.
+    Use as `async with await mongo.causal_session() as session`.
+    """
+    return client.start_session(causal_consistency=True)
+
+
+def connect():
+    global client, db, analytics_db
+    if ANALYTICS_READ_PREFERENCE not in READ_PREFERENCES:
+        raise ValueError(f"Unknown ANALYTICS_READ_PREFERENCE: {ANALYTICS_READ_PREFERENCE}")
+
+    client = AsyncIOMotorClient(
+        MONGO_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    )
+    db = client[DATABASE_NAME]
+    analytics_db = client.get_database(
+        DATABASE_NAME,
+        read_preference=READ_PREFERENCES[ANALYTICS_READ_PREFERENCE],
+    )
+
+
+def close():
+    global client, db, analytics_db
+    if client is not None:
+        client.close()
+    client = db = analytics_db = None
+
+
+async def ensure_indexes(database):
+    """Create the indexes the handlers' queries rely on (idempotent)
+
+    Every query is scoped to an organization (see tenancy.py), so indexes
+    lead with org_id.
+    """
+    await database.trees.create_index([("org_id", 1), ("id", 1)])
+    await database.trees.create_index([("org_id", 1), ("area_id", 1)])
+    await database.trees.create_index([("org_id", 1), ("lat", 1), ("lng", 1)])
+    await database.work_areas.create_index([("org_id", 1), ("id", 1)])
+    await database.gps_tracks.create_index([("org_id", 1), ("id", 1)])
+    await database.vector_layers.create_index([("org_id", 1), ("id", 1)])
+    await database.measurements.create_index([("org_id", 1), ("id", 1)])
+    await database.analytics_rollups.create_index([("org_id", 1), ("kind", 1)])
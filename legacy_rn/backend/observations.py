@@ -0,0 +1,116 @@
+"""Append-only tree observation history
+
+Every tree create, update and bulk survey appends the tree's measured
+state to `tree_observations`, a MongoDB time-series collection:
+
+    {"observed_at": <date>, "meta": {"tree_id", "area_id", "species"},
+     "health": "warning", "diameter": 31.5, "height": 17.0, "source": "survey"}
+
+Mongo buckets documents by `meta` and time, so per-tree timelines and
+per-area trend aggregations read a few compressed buckets per tree rather
+than one document per measurement.
+"""
+import os
+
+from pymongo.errors import CollectionInvalid
+
+OBSERVATIONS_GRANULARITY = os.getenv("OBSERVATIONS_GRANULARITY", "hours")
+
+TREND_INTERVALS = ("day", "week", "month", "quarter", "year")
+
+FIELDS = ("health", "diameter", "height")
+
+
+async def ensure_collection(db):
+    if "tree_observations" not in await db.list_collection_names():
+        try:
+            await db.create_collection(
+                "tree_observations",
+                timeseries={
+                    "timeField": "observed_at",
+                    "metaField": "meta",
+                    "granularity": OBSERVATIONS_GRANULARITY,
+                },
+            )
+        except CollectionInvalid:
+            pass  # created concurrently by another worker
+    await db.tree_observations.create_index([("meta.org_id", 1), ("meta.tree_id", 1), ("observed_at", 1)])
+    await db.tree_observations.create_index([("meta.org_id", 1), ("meta.area_id", 1), ("observed_at", 1)])
+
+
+def _observation(tree, observed_at, source):
+    return {
+        "observed_at": observed_at,
+        "meta": {
+            "tree_id": tree["id"],
+            "area_id": tree.get("area_id"),
+            "species": tree.get("species"),
+        },
+        **{field: tree.get(field) for field in FIELDS},
+        "source": source,
+    }
+
+
+async def record(db, trees, observed_at, source):
+    """Append the current state of each tree as one observation"""
+    docs = [_observation(tree, observed_at, source) for tree in trees]
+    if docs:
+        await db.tree_observations.insert_many(docs, ordered=False)
+
+
+def _time_range(start, end):
+    time_range = {}
+    if start:
+        time_range["$gte"] = start
+    if end:
+        time_range["$lte"] = end
+    return time_range
+
+
+async def tree_timeline(db, tree_id, start=None, end=None):
+    query = {"meta.tree_id": tree_id}
+    if start or end:
+        query["observed_at"] = _time_range(start, end)
+    docs = await db.tree_observations.find(
+        query, {"_id": 0, "observed_at": 1, "source": 1, **{field: 1 for field in FIELDS}}
+    ).sort("observed_at", 1).to_list(None)
+    return docs
+
+
+async def area_trends(db, area_id, interval="month", start=None, end=None):
+    """Per time bucket: latest state of each observed tree, then aggregated
+
+    A tree surveyed twice in one bucket counts once with its later values.
+    """
+    match = {"meta.area_id": area_id}
+    if start or end:
+        match["observed_at"] = _time_range(start, end)
+
+    def health_count(state):
+        return {"$sum": {"$cond": [{"$eq": ["$last.health", state]}, 1, 0]}}
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "bucket": {"$dateTrunc": {"date": "$observed_at", "unit": interval}},
+                "tree_id": "$meta.tree_id",
+            },
+            "last": {"$top": {
+                "sortBy": {"observed_at": -1},
+                "output": {field: f"${field}" for field in FIELDS},
+            }},
+        }},
+        {"$group": {
+            "_id": "$_id.bucket",
+            "trees_observed": {"$sum": 1},
+            "avg_diameter": {"$avg": "$last.diameter"},
+            "avg_height": {"$avg": "$last.height"},
+            "healthy": health_count("healthy"),
+            "warning": health_count("warning"),
+            "critical": health_count("critical"),
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+    rows = await db.tree_observations.aggregate(pipeline).to_list(None)
+    return [{"period_start": row.pop("_id"), **row} for row in rows]
@@ -0,0 +1,69 @@
+"""Nearest-neighbour and radius search over trees
+
+Trees carry a GeoJSON `location` point (written on create, backfilled
+from lat/lng by a background job) under a 2dsphere index, and queries use
+`$geoNear`. The index is maintained by Mongo on every write, so results
+are always consistent with the stored trees and with other workers,
+which an in-process KD-tree would not be.
+"""
+import asyncio
+import logging
+import os
+
+PROXIMITY_MAX_K = int(os.getenv("PROXIMITY_MAX_K", "1000"))
+PROXIMITY_MAX_BATCH = int(os.getenv("PROXIMITY_MAX_BATCH", "500"))
+PROXIMITY_BATCH_CONCURRENCY = int(os.getenv("PROXIMITY_BATCH_CONCURRENCY", "16"))
+
+logger = logging.getLogger("proximity")
+
+
+def location(lat, lng):
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+
+async def ensure_location_index(db):
+    await db.trees.create_index([("org_id", 1), ("location", "2dsphere")])
+
+
+async def backfill_locations(db):
+    """Set location on trees stored before it existed"""
+    # Out-of-range points would be rejected by the 2dsphere index; they stay
+    # without a location (and out of proximity results) until corrected
+    await db.trees.update_many(
+        {"location": {"$exists": False}, "lat": {"$gte": -90, "$lte": 90}, "lng": {"$gte": -180, "$lte": 180}},
+        [{"$set": {"location": {"type": "Point", "coordinates": ["$lng", "$lat"]}}}],
+    )
+    invalid = await db.trees.count_documents({"location": {"$exists": False}})
+    if invalid:
+        logger.warning("%d trees in %s have no valid lat/lng and no location", invalid, db.name)
+
+
+async def nearest_trees(db, lat, lng, k=10, max_distance=None, query=None):
+    """Up to k trees closest to (lat, lng), nearest first, with distance_m"""
+    geo_near = {
+        "near": location(lat, lng),
+        "key": "location",
+        "distanceField": "distance_m",
+        "spherical": True,
+    }
+    if max_distance is not None:
+        geo_near["maxDistance"] = max_distance
+    if query:
+        geo_near["query"] = query
+    pipeline = [
+        {"$geoNear": geo_near},
+        {"$limit": k},
+        {"$project": {"photos": 0, "location": 0}},
+    ]
+    return await db.trees.aggregate(pipeline).to_list(None)
+
+
+async def nearest_trees_batch(db, queries, query=None):
+    """Run many nearest_trees lookups concurrently, results in query order"""
+    semaphore = asyncio.Semaphore(PROXIMITY_BATCH_CONCURRENCY)
+
+    async def run(q):
+        async with semaphore:
+            return await nearest_trees(db, q["lat"], q["lng"], q["k"], q.get("max_distance"), query)
+
+    return await asyncio.gather(*(run(q) for q in queries))
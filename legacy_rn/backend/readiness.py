@@ -0,0 +1,53 @@
+"""Startup preparation and the readiness state behind /api/ready
+
+Workers accept connections as soon as the app is imported. Pinging Mongo
+and building indexes run in `prepare` in the background, and /api/ready
+answers 503 until they are done, so load balancers and the autoscaler
+should route traffic by /api/ready; /api/health only says the
+process is up. Tree writes answer 503 as well until `indexes` is set,
+because their first observation would otherwise create tree_observations
+as a plain collection instead of a time-series one. Data backfills are a
+leader-only scheduler job, so startup does not grow with the inventory.
+"""
+import asyncio
+import logging
+import os
+import time
+
+import jobs
+import mongo
+
+READY_RETRY_SECONDS = float(os.getenv("READY_RETRY_SECONDS", "5"))
+READY_PING_TIMEOUT_SECONDS = float(os.getenv("READY_PING_TIMEOUT_SECONDS", "1"))
+
+logger = logging.getLogger("readiness")
+
+state = {"ready": False, "indexes": False, "error": None, "ready_after_s": None}
+
+
+async def ping():
+    """Whether Mongo answers within READY_PING_TIMEOUT_SECONDS"""
+    try:
+        await asyncio.wait_for(mongo.client.admin.command("ping"), READY_PING_TIMEOUT_SECONDS)
+        return True
+    except Exception:
+        return False
+
+
+async def prepare(scheduler):
+    """Build indexes (retrying until Mongo is up), then start the scheduler"""
+    started = time.perf_counter()
+    while True:
+        try:
+            # Also creates the time-series collection, which must precede the first write
+            await jobs.ensure_indexes()
+            break
+        except Exception as e:
+            state["error"] = repr(e)
+            logger.warning("Startup preparation failed, retrying in %ss: %r", READY_RETRY_SECONDS, e)
+            await asyncio.sleep(READY_RETRY_SECONDS)
+    state.update(ready=True, indexes=True, error=None, ready_after_s=time.perf_counter() - started)
+    logger.info("Ready after %.2fs", state["ready_after_s"])
+
+    # Migrations run as leader-only scheduler jobs, so one worker performs them
+    scheduler.start()
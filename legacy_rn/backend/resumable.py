@@ -0,0 +1,159 @@
+"""Resumable chunked uploads for photos and GPS track files (tus-like)
+
+    POST  /api/uploads                  open a session for `length` bytes
+    GET   /api/uploads/{id}             committed offset, to resume from
+    PATCH /api/uploads/{id}             write the request body at Upload-Offset
+    POST  /api/uploads/{id}/finalize    turn the bytes into a photo or track
+
+Bytes are written to UPLOAD_SESSION_DIR/<id>.part on local disk, like
+uploads/ itself; the session document in `upload_sessions` holds the
+committed offset. A chunk is written at its offset before the offset is
+advanced with a compare-and-set, so a retried chunk only rewrites the
+same bytes, and the bytes received before a dropped connection are kept.
+Sessions expire UPLOAD_SESSION_TTL_HOURS after their last chunk. A
+finalize claim left by a crashed worker can be taken over once
+UPLOAD_FINALIZE_LEASE_SECONDS have passed.
+"""
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import aiofiles
+
+UPLOAD_SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", "upload_sessions")
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "500")) * 2**20
+UPLOAD_FINALIZE_LEASE_SECONDS = int(os.getenv("UPLOAD_FINALIZE_LEASE_SECONDS", "300"))
+
+UPLOAD_KINDS = ["photo", "gps_track"]
+
+
+class OffsetMismatch(Exception):
+    def __init__(self, offset):
+        super().__init__(f"Upload-Offset does not match, current offset is {offset}")
+        self.offset = offset
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def part_path(upload_id):
+    return os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.part")
+
+
+def _now_ms():
+    """Current time at Mongo's millisecond precision, so it can be matched later"""
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _expiry():
+    return datetime.utcnow() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS)
+
+
+async def ensure_indexes(db):
+    await db.upload_sessions.create_index([("org_id", 1), ("id", 1)])
+    await db.upload_sessions.create_index("expires_at", expireAfterSeconds=0)
+
+
+async def create_session(db, kind, length, metadata):
+    os.makedirs(UPLOAD_SESSION_DIR, exist_ok=True)
+    session = {
+        "id": str(uuid.uuid4()),
+        "kind": kind,
+        "length": length,
+        "offset": 0,
+        "state": "open",
+        "metadata": metadata,
+        "created_at": datetime.utcnow(),
+        "expires_at": _expiry(),
+    }
+    async with aiofiles.open(part_path(session["id"]), "wb"):
+        pass
+    await db.upload_sessions.insert_one(session)
+    return session
+
+
+async def _advance(db, upload_id, offset, written):
+    result = await db.upload_sessions.update_one(
+        {"id": upload_id, "offset": offset, "state": "open"},
+        {"$set": {"offset": offset + written, "expires_at": _expiry()}},
+    )
+    if result.matched_count == 0:
+        # A concurrent retry of the same chunk got there first
+        current = await db.upload_sessions.find_one({"id": upload_id}, {"offset": 1})
+        raise OffsetMismatch(current["offset"] if current else None)
+    return offset + written
+
+
+async def write_chunk(db, session, offset, chunks):
+    """Write an async iterable of bytes at `offset`; returns the new offset"""
+    if offset != session["offset"]:
+        raise OffsetMismatch(session["offset"])
+    written = 0
+    try:
+        async with aiofiles.open(part_path(session["id"]), "r+b") as f:
+            await f.seek(offset)
+            async for chunk in chunks:
+                if offset + written + len(chunk) > session["length"]:
+                    raise UploadTooLarge(f"Upload is longer than the declared {session['length']} bytes")
+                await f.write(chunk)
+                written += len(chunk)
+    finally:
+        if written:
+            offset = await _advance(db, session["id"], offset, written)
+    return offset
+
+
+async def claim_finalize(db, upload_id):
+    """Move a complete session to `finalizing`; returns the claim time, None if another request holds it"""
+    now = _now_ms()
+    stale = now - timedelta(seconds=UPLOAD_FINALIZE_LEASE_SECONDS)
+    session = await db.upload_sessions.find_one_and_update(
+        {"id": upload_id, "$expr": {"$eq": ["$offset", "$length"]},
+         "$or": [{"state": "open"}, {"state": "finalizing", "finalizing_at": {"$lt": stale}}]},
+        {"$set": {"state": "finalizing", "finalizing_at": now}},
+    )
+    return now if session is not None else None
+
+
+async def release_finalize(db, upload_id, claimed_at):
+    """Reopen the session, unless the claim was taken over meanwhile"""
+    await db.upload_sessions.update_one(
+        {"id": upload_id, "state": "finalizing", "finalizing_at": claimed_at}, {"$set": {"state": "open"}}
+    )
+
+
+async def complete(db, upload_id, result):
+    """Store the finalize response so a repeated finalize returns it again"""
+    await db.upload_sessions.update_one(
+        {"id": upload_id}, {"$set": {"state": "done", "result": result, "expires_at": _expiry()}}
+    )
+    try:
+        os.remove(part_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def load_json(upload_id):
+    with open(part_path(upload_id), "rb") as f:
+        return json.load(f)
+
+
+def evict_stale_parts_sync(max_age_hours=UPLOAD_SESSION_TTL_HOURS):
+    """Delete part files of sessions untouched for longer than their TTL"""
+    if not os.path.isdir(UPLOAD_SESSION_DIR):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    deleted = 0
+    for entry in os.scandir(UPLOAD_SESSION_DIR):
+        if entry.name.endswith(".part") and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                deleted += 1
+            except FileNotFoundError:
+                pass
+    return deleted
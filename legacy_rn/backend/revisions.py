@@ -0,0 +1,27 @@
+"""Monotonic data revision counters
+
+Writers bump a named counter of their organization in the `revisions`
+collection; readers use the current values as cache keys (together with
+db.org_id), so any cache keyed by revision is invalidated across all
+worker processes as soon as the data changes.
+"""
+from pymongo import UpdateOne
+
+import tenancy
+
+TREES = "trees"
+WORK_AREAS = "work_areas"
+
+
+async def bump(db, *names):
+    ops = [UpdateOne({"_id": tenancy.scoped_id(db, name)}, {"$inc": {"value": 1}}, upsert=True) for name in names]
+    if ops:
+        await db.revisions.bulk_write(ops, ordered=False)
+
+
+async def current(db, *names, session=None):
+    """Current value of each counter, in argument order (0 if never bumped)"""
+    ids = [tenancy.scoped_id(db, name) for name in names]
+    docs = await db.revisions.find({"_id": {"$in": ids}}, session=session).to_list(None)
+    values = {doc["_id"]: doc["value"] for doc in docs}
+    return tuple(values.get(doc_id, 0) for doc_id in ids)
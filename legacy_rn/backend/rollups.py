@@ -0,0 +1,177 @@
+"""Incrementally maintained tree counts for the analytics endpoints
+
+The `analytics_rollups` collection holds one counter document per
+dimension value and organization:
+
+    {"_id": "org1:species:スギ", "org_id": "org1", "kind": "species", "key": "スギ", "count": 120}
+
+Kinds are `total`, `species`, `health`, `area` (by area_id) and `day`
+(creation date, YYYY-MM-DD). Tree handlers apply +1/-1 deltas on every
+insert, update and delete, so dashboard reads cost a handful of point
+lookups regardless of inventory size. `reconcile` recomputes everything
+from `trees` to repair drift from failed or concurrent writes; the
+scheduler runs it at startup and every ROLLUP_RECONCILE_INTERVAL. It
+retries while revisions.TREES moves, which narrows but does not close the
+race with concurrent writers (see `reconcile`).
+"""
+import logging
+import os
+from collections import Counter
+from datetime import datetime
+
+from pymongo import UpdateOne, ReplaceOne
+
+import revisions
+import tenancy
+
+ROLLUP_RECONCILE_ATTEMPTS = int(os.getenv("ROLLUP_RECONCILE_ATTEMPTS", "3"))
+
+logger = logging.getLogger("rollups")
+
+
+def _rollup_id(db, kind, key):
+    return tenancy.scoped_id(db, f"{kind}:{key}")
+
+
+def _tree_keys(tree):
+    created_at = tree.get("created_at")
+    keys = [("total", "all"), ("species", tree.get("species")), ("health", tree.get("health"))]
+    if tree.get("area_id"):
+        keys.append(("area", tree["area_id"]))
+    if isinstance(created_at, datetime):
+        keys.append(("day", created_at.strftime("%Y-%m-%d")))
+    return keys
+
+
+async def _apply(db, deltas):
+    ops = [
+        UpdateOne(
+            {"_id": _rollup_id(db, kind, key)},
+            {"$inc": {"count": delta}, "$setOnInsert": {"kind": kind, "key": key}},
+            upsert=True,
+        )
+        for (kind, key), delta in deltas.items()
+        if delta
+    ]
+    if ops:
+        await db.analytics_rollups.bulk_write(ops, ordered=False)
+
+
+async def apply_tree_insert(db, tree):
+    await _apply(db, Counter(_tree_keys(tree)))
+
+
+async def apply_tree_delete(db, tree):
+    await _apply(db, Counter({key: -1 for key in _tree_keys(tree)}))
+
+
+async def apply_tree_update(db, before, after):
+    await apply_tree_updates(db, [(before, after)])
+
+
+async def apply_tree_updates(db, changes):
+    """Apply many (before, after) pairs in a single bulk write"""
+    deltas = Counter()
+    for before, after in changes:
+        deltas.update(_tree_keys(after))
+        deltas.subtract(_tree_keys(before))
+    await _apply(db, deltas)
+
+
+async def _count_trees(db):
+    pipeline = [
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "species": [{"$group": {"_id": "$species", "count": {"$sum": 1}}}],
+            "health": [{"$group": {"_id": "$health", "count": {"$sum": 1}}}],
+            "area": [
+                {"$match": {"area_id": {"$nin": [None, ""]}}},
+                {"$group": {"_id": "$area_id", "count": {"$sum": 1}}},
+            ],
+            "day": [
+                {"$match": {"created_at": {"$type": "date"}}},
+                {"$group": {
+                    "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                    "count": {"$sum": 1},
+                }},
+            ],
+        }}
+    ]
+    facets = (await db.trees.aggregate(pipeline).to_list(None))[0]
+    docs = [{"kind": "total", "key": "all", "count": facets["total"][0]["count"] if facets["total"] else 0}]
+    for kind in ("species", "health", "area", "day"):
+        docs.extend({"kind": kind, "key": row["_id"], "count": row["count"]} for row in facets[kind])
+    for doc in docs:
+        doc["_id"] = _rollup_id(db, doc["kind"], doc["key"])
+    return docs
+
+
+async def reconcile(db, attempts=ROLLUP_RECONCILE_ATTEMPTS):
+    """Rebuild every rollup document from the `trees` collection
+
+    Tree writers bump revisions.TREES after applying their deltas. If it
+    changes while the counts are computed, they are recomputed; if it
+    changes while they are written, a delta may have been overwritten, so
+    the rebuild runs again. Returns the number of rollup documents, or
+    None if the trees never stood still for `attempts` runs.
+
+    This is not exact: a writer whose tree is already counted but whose
+    delta lands after the counters are written, and whose bump lands after
+    the final check, is counted twice (a writer stalled between its delta
+    and its bump likewise goes unnoticed). The window is one writer's few
+    milliseconds between its tree write and its bump; the error lasts until
+    the next run.
+    """
+    for _ in range(attempts):
+        start = await revisions.current(db, revisions.TREES)
+        docs = await _count_trees(db)
+        if await revisions.current(db, revisions.TREES) != start:
+            continue
+        await db.analytics_rollups.bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs], ordered=False
+        )
+        await db.analytics_rollups.delete_many({"_id": {"$nin": [doc["_id"] for doc in docs]}})
+        if await revisions.current(db, revisions.TREES) == start:
+            return len(docs)
+    logger.warning("Rollup reconciliation for %s skipped: trees kept changing", db.org_id)
+    return None
+
+
+# Reads
+
+async def summary_counts(db):
+    docs = await db.analytics_rollups.find({"kind": {"$in": ["total", "health"]}}).to_list(None)
+    counts = {(doc["kind"], doc["key"]): doc["count"] for doc in docs}
+    return {
+        "total_trees": counts.get(("total", "all"), 0),
+        "healthy_trees": counts.get(("health", "healthy"), 0),
+        "warning_trees": counts.get(("health", "warning"), 0),
+        "critical_trees": counts.get(("health", "critical"), 0),
+    }
+
+
+async def species_distribution(db):
+    docs = await db.analytics_rollups.find(
+        {"kind": "species", "count": {"$gt": 0}}
+    ).sort("count", -1).to_list(None)
+    return [{"species": doc["key"], "count": doc["count"]} for doc in docs]
+
+
+async def area_tree_counts(db, area_ids):
+    docs = await db.analytics_rollups.find(
+        {"_id": {"$in": [_rollup_id(db, "area", area_id) for area_id in area_ids]}}
+    ).to_list(None)
+    return {doc["key"]: doc["count"] for doc in docs}
+
+
+async def daily_counts(db, start=None, end=None):
+    """Trees created per day, optionally limited to [start, end] (YYYY-MM-DD)"""
+    query = {"kind": "day", "count": {"$gt": 0}}
+    if start or end:
+        query["key"] = {}
+        if start:
+            query["key"]["$gte"] = start
+        if end:
+            query["key"]["$lte"] = end
+    docs = await db.analytics_rollups.find(query).sort("key", 1).to_list(None)
+    return [{"date": doc["key"], "count": doc["count"]} for doc in docs]
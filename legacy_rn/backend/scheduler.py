@@ -0,0 +1,144 @@
+"""In-process periodic job scheduler with Mongo-based leader election
+
+Every worker process runs a Scheduler. Jobs that touch shared data
+(reconciliation, index maintenance) are `leader_only` and run in exactly
+one process: the holder of the `scheduler_locks` lease document, which it
+renews every SCHEDULER_LEASE_SECONDS / 3. If the leader dies its lease
+expires and another worker takes over. Jobs that fill per-process state
+(cache warming) or local disk (file eviction) run in every worker.
+
+The last run of each job is recorded in `scheduler_jobs`.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1").lower() in ("1", "true", "yes")
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "60"))
+
+LEADER_LOCK_ID = "scheduler-leader"
+
+logger = logging.getLogger("scheduler")
+
+
+class Job:
+    def __init__(self, name, interval, func, leader_only=True, run_at_start=False):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.leader_only = leader_only
+        self.run_at_start = run_at_start
+
+
+class Scheduler:
+    def __init__(self, db, lease_seconds=SCHEDULER_LEASE_SECONDS):
+        self.db = db
+        self.lease = timedelta(seconds=lease_seconds)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.jobs = []
+        self._tasks = []
+
+    def add_job(self, name, interval, func, leader_only=True, run_at_start=False):
+        """Run `await func()` every `interval` seconds"""
+        self.jobs.append(Job(name, interval, func, leader_only, run_at_start))
+
+    async def _renew_leadership(self):
+        now = datetime.utcnow()
+        try:
+            await self.db.scheduler_locks.update_one(
+                {"_id": LEADER_LOCK_ID, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + self.lease, "renewed_at": now}},
+                upsert=True,
+            )
+            became_leader = not self.is_leader
+            self.is_leader = True
+            if became_leader:
+                logger.info("Scheduler %s is now the leader", self.owner)
+        except DuplicateKeyError:
+            # The lock exists, is unexpired and belongs to another worker
+            self.is_leader = False
+
+    async def _leadership_loop(self):
+        while True:
+            try:
+                await self._renew_leadership()
+            except Exception:
+                logger.exception("Scheduler leader election failed")
+                self.is_leader = False
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+
+    async def run_job(self, job):
+        started = time.perf_counter()
+        error = None
+        try:
+            await job.func()
+        except Exception as e:
+            error = repr(e)
+            logger.exception("Scheduled job %s failed", job.name)
+        await self.db.scheduler_jobs.update_one(
+            {"_id": job.name},
+            {"$set": {
+                "last_run_at": datetime.utcnow(),
+                "last_duration_s": time.perf_counter() - started,
+                "last_error": error,
+                "owner": self.owner,
+            }},
+            upsert=True,
+        )
+
+    async def _job_loop(self, job):
+        if not job.run_at_start:
+            # Spread the first runs of all workers over the interval
+            await asyncio.sleep(random.uniform(0, job.interval))
+        elif job.leader_only:
+            # Give the first election a chance to finish
+            await asyncio.sleep(1)
+        while True:
+            if self.is_leader or not job.leader_only:
+                try:
+                    await self.run_job(job)
+                except Exception:
+                    logger.exception("Recording job %s failed", job.name)
+            await asyncio.sleep(job.interval)
+
+    def start(self):
+        if not SCHEDULER_ENABLED:
+            return
+        self._tasks.append(asyncio.create_task(self._leadership_loop()))
+        self._tasks.extend(asyncio.create_task(self._job_loop(job)) for job in self.jobs)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.is_leader:
+            # Hand over immediately instead of waiting for the lease to expire
+            await self.db.scheduler_locks.delete_one({"_id": LEADER_LOCK_ID, "owner": self.owner})
+            self.is_leader = False
+
+    async def status(self):
+        lock = await self.db.scheduler_locks.find_one({"_id": LEADER_LOCK_ID})
+        runs = {doc["_id"]: doc for doc in await self.db.scheduler_jobs.find().to_list(None)}
+        return {
+            "enabled": SCHEDULER_ENABLED,
+            "worker": self.owner,
+            "leader": lock.get("owner") if lock else None,
+            "jobs": [
+                {
+                    "name": job.name,
+                    "interval_s": job.interval,
+                    "leader_only": job.leader_only,
+                    **{k: v for k, v in runs.get(job.name, {}).items() if k != "_id"},
+                }
+                for job in self.jobs
+            ],
+        }
@@ -1,37 +1,71 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Header, Query, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import DuplicateKeyError
+from fastapi.responses import FileResponse, Response
+from pymongo import ReturnDocument, UpdateOne
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
+from contextlib import asynccontextmanager
 import os
+import shutil
+import tempfile
 import uuid
-import json
 import aiofiles
-from datetime import datetime, timedelta
-import pandas as pd
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-from bson import ObjectId
-import base64
-from io import BytesIO
-import requests
-from geopy.distance import geodesic
+from datetime import datetime
 import asyncio
 
 # Environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-DATABASE_NAME = os.getenv("DATABASE_NAME", "forest_management")
-
-app = FastAPI(title="森林管理GIS API", version="1.0.0")
+# Local modules read their configuration from the environment at import time
+import boundaries
+import executor
+import heatmap
+import idempotency
+import jobs
+import kernels
+import loop_monitor
+import mongo
+import observations
+import proximity
+import readiness
+import resumable
+import revisions
+import rollups
+import scheduler
+import stands
+import tenancy
+import tree_lists
+import vector_layers
+from kernels import serialize_doc, serialize_docs
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8001"))
+# Number of uvicorn worker processes; each gets its own Mongo pool and CPU executor
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    mongo.connect()
+    executor.start()
+    monitor = loop_monitor.start_monitor()
+    app.state.scheduler = scheduler.Scheduler(mongo.db)
+    jobs.register(app.state.scheduler)
+    # Indexes and migrations are built in the background; see /api/ready
+    preparation = asyncio.create_task(readiness.prepare(app.state.scheduler))
+    yield
+    preparation.cancel()
+    await app.state.scheduler.stop()
+    if monitor:
+        monitor.stop()
+    executor.shutdown()
+    mongo.close()
+
+app = FastAPI(title="森林管理GIS API", version="1.0.0", lifespan=lifespan)
+
+# Organization scoping (X-Org-Id header)
+app.add_middleware(tenancy.TenantMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -42,10 +76,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# MongoDB client
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DATABASE_NAME]
-
 # Static files
 os.makedirs("uploads", exist_ok=True)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
@@ -54,8 +84,8 @@ app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 class TreeCreate(BaseModel):
     species: str
     health: str = "healthy"
-    lat: float
-    lng: float
+    lat: float = Field(ge=-90, le=90)
+    lng: float = Field(ge=-180, le=180)
     diameter: float = 0
     height: float = 0
     notes: str = ""
@@ -71,7 +101,7 @@ class TreeUpdate(BaseModel):
 class WorkAreaCreate(BaseModel):
     name: str
     status: str = "active"
-    boundary: List[List[float]]
+    boundary: List[List[float]] = []  # empty until the area is traced
     description: str = ""
 
 class WorkAreaUpdate(BaseModel):
@@ -89,7 +119,7 @@ class VectorLayerCreate(BaseModel):
     name: str
     layer_type: str  # point, line, polygon
     color: str
-    data: List[Dict[str, Any]]
+    data: List[Dict[str, Any]] = []  # GeoJSON Features or {coordinates, properties}
     visible: bool = True
 
 class MeasurementCreate(BaseModel):
@@ -98,17 +128,89 @@ class MeasurementCreate(BaseModel):
     distance: float
     measurement_type: str = "distance"
 
-# Utility functions
-def serialize_doc(doc):
-    """Convert MongoDB document to JSON serializable format"""
-    if doc is None:
-        return None
-    doc["_id"] = str(doc["_id"])
-    return doc
+class StandPolygon(BaseModel):
+    boundary: List[List[float]]
 
-def serialize_docs(docs):
-    """Convert list of MongoDB documents to JSON serializable format"""
-    return [serialize_doc(doc) for doc in docs]
+class SurveyObservation(BaseModel):
+    tree_id: str
+    health: Optional[str] = None
+    diameter: Optional[float] = None
+    height: Optional[float] = None
+    notes: Optional[str] = None
+
+class SurveyCreate(BaseModel):
+    observed_at: Optional[datetime] = None
+    observations: List[SurveyObservation]
+
+class UploadCreate(BaseModel):
+    kind: str  # photo, gps_track
+    length: int
+    filename: Optional[str] = None
+    tree_id: Optional[str] = None  # required for photos
+
+class NearestQuery(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lng: float = Field(ge=-180, le=180)
+    k: Optional[int] = None
+    max_distance: Optional[float] = None
+
+class NearestBatch(BaseModel):
+    queries: List[NearestQuery]
+    k: int = 10
+    max_distance: Optional[float] = None
+    area_id: Optional[str] = None
+    health: Optional[str] = None
+
+# Utility functions
+def parse_bbox(bbox: str):
+    """Parse a "min_lat,min_lng,max_lat,max_lng" query parameter"""
+    try:
+        min_lat, min_lng, max_lat, max_lng = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lat,min_lng,max_lat,max_lng")
+    if min_lat >= max_lat or min_lng >= max_lng:
+        raise HTTPException(status_code=400, detail="Invalid bbox")
+    return min_lat, min_lng, max_lat, max_lng
+
+def _require_indexes():
+    """Tree writes append to tree_observations, which startup must create as a
+    time-series collection first (a write would create a plain one)"""
+    if not readiness.state["indexes"]:
+        raise HTTPException(status_code=503, detail="Service is starting, retry shortly")
+
+def _tree_filter(area_id: Optional[str], health: Optional[str]):
+    query = {}
+    if area_id:
+        query["area_id"] = area_id
+    if health:
+        query["health"] = health
+    return query
+
+async def _boundary_fields(boundary):
+    """Validated boundary plus its precomputed geometry, 400 if it can't be repaired"""
+    try:
+        return await executor.run_blocking(boundaries.derived_fields, boundary)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid boundary: {e}")
+
+def _check_detail(detail: str):
+    if detail not in boundaries.DETAILS:
+        raise HTTPException(status_code=400, detail=f"detail must be one of {', '.join(boundaries.DETAILS)}")
+
+def _check_k(k: int):
+    if not 1 <= k <= proximity.PROXIMITY_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {proximity.PROXIMITY_MAX_K}")
+
+async def _idempotent(scope: str, key: Optional[str], payload, create):
+    """Run create() at most once per Idempotency-Key header value"""
+    if not key:
+        return await create()
+    try:
+        return await idempotency.run(tenancy.db(), scope, key, payload, create)
+    except idempotency.KeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except idempotency.KeyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 # API Routes
 
@@ -116,61 +218,162 @@ def serialize_docs(docs):
 async def root():
     return {"message": "森林管理GIS API", "version": "1.0.0"}
 
+# Health endpoints
+@app.get("/api/health")
+async def health():
+    """Liveness: the process is up"""
+    return {"status": "ok"}
+
+@app.get("/api/ready")
+async def ready():
+    """Readiness: Mongo reachable and startup indexes built"""
+    status = {**readiness.state, "mongo": await readiness.ping()}
+    if not (status["ready"] and status["mongo"]):
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
 # Tree management endpoints
 @app.post("/api/trees")
-async def create_tree(tree: TreeCreate):
+async def create_tree(tree: TreeCreate, idempotency_key: Optional[str] = Header(None)):
+    _require_indexes()
+    return await _idempotent("trees", idempotency_key, tree.dict(), lambda: _insert_tree(tree))
+
+async def _insert_tree(tree: TreeCreate):
     tree_doc = {
         **tree.dict(),
         "id": str(uuid.uuid4()),
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow(),
         "photos": [],
-        "last_check": datetime.utcnow().isoformat()
+        "last_check": datetime.utcnow().isoformat(),
+        "location": proximity.location(tree.lat, tree.lng)
     }
     
-    result = await db.trees.insert_one(tree_doc)
+    result = await tenancy.db().trees.insert_one(tree_doc)
+    await rollups.apply_tree_insert(tenancy.db(), tree_doc)
+    await tree_lists.bump(tenancy.db(), tree_doc)
+    await observations.record(tenancy.db(), [tree_doc], tree_doc["created_at"], "create")
     tree_doc["_id"] = str(result.inserted_id)
     return serialize_doc(tree_doc)
 
 @app.get("/api/trees")
 async def get_trees(area_id: Optional[str] = None, health: Optional[str] = None):
-    query = {}
-    if area_id:
-        query["area_id"] = area_id
-    if health:
-        query["health"] = health
-    
-    trees = await db.trees.find(query).to_list(None)
+    content = await tree_lists.tree_list_json(tenancy.db(), _tree_filter(area_id, health))
+    return Response(content=content, media_type="application/json")
+
+@app.get("/api/trees/nearest")
+async def get_nearest_trees(
+    lat: float = Query(ge=-90, le=90),
+    lng: float = Query(ge=-180, le=180),
+    k: int = 10,
+    max_distance: Optional[float] = None,
+    area_id: Optional[str] = None,
+    health: Optional[str] = None
+):
+    """The k trees nearest to (lat, lng), each with distance_m, optionally within max_distance meters"""
+    _check_k(k)
+    trees = await proximity.nearest_trees(
+        tenancy.db(), lat, lng, k, max_distance, _tree_filter(area_id, health)
+    )
     return serialize_docs(trees)
 
+@app.post("/api/trees/nearest/batch")
+async def get_nearest_trees_batch(batch: NearestBatch):
+    if len(batch.queries) > proximity.PROXIMITY_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {proximity.PROXIMITY_MAX_BATCH} queries per batch")
+    queries = []
+    for q in batch.queries:
+        k = q.k or batch.k
+        _check_k(k)
+        max_distance = q.max_distance if q.max_distance is not None else batch.max_distance
+        queries.append({"lat": q.lat, "lng": q.lng, "k": k, "max_distance": max_distance})
+    
+    results = await proximity.nearest_trees_batch(
+        tenancy.db(), queries, _tree_filter(batch.area_id, batch.health)
+    )
+    return [
+        {"lat": q["lat"], "lng": q["lng"], "trees": serialize_docs(trees)}
+        for q, trees in zip(queries, results)
+    ]
+
+@app.post("/api/trees/survey")
+async def submit_survey(survey: SurveyCreate):
+    """Apply a batch of field measurements and append them to the history"""
+    _require_indexes()
+    observed_at = survey.observed_at or datetime.utcnow()
+    updates = {}
+    for observation in survey.observations:
+        update_data = {k: v for k, v in observation.dict().items() if v is not None and k != "tree_id"}
+        # Later entries for the same tree win
+        updates.setdefault(observation.tree_id, {}).update(update_data)
+    
+    before_docs = await tenancy.db().trees.find({"id": {"$in": list(updates)}}).to_list(None)
+    if not before_docs:
+        raise HTTPException(status_code=404, detail="No matching trees")
+    
+    now = datetime.utcnow()
+    changes = []
+    ops = []
+    for before in before_docs:
+        update_data = {**updates[before["id"]], "updated_at": now, "last_check": observed_at.isoformat()}
+        ops.append(UpdateOne({"id": before["id"]}, {"$set": update_data}))
+        changes.append((before, {**before, **update_data}))
+    
+    await tenancy.db().trees.bulk_write(ops, ordered=False)
+    await rollups.apply_tree_updates(tenancy.db(), changes)
+    await tree_lists.bump(tenancy.db(), *(tree for change in changes for tree in change))
+    await observations.record(tenancy.db(), [after for _, after in changes], observed_at, "survey")
+    
+    found = {before["id"] for before in before_docs}
+    return {
+        "updated": len(found),
+        "missing": [tree_id for tree_id in updates if tree_id not in found],
+        "observed_at": observed_at
+    }
+
 @app.get("/api/trees/{tree_id}")
 async def get_tree(tree_id: str):
-    tree = await db.trees.find_one({"id": tree_id})
+    tree = await tenancy.db().trees.find_one({"id": tree_id})
     if not tree:
         raise HTTPException(status_code=404, detail="Tree not found")
     return serialize_doc(tree)
 
 @app.put("/api/trees/{tree_id}")
 async def update_tree(tree_id: str, tree_update: TreeUpdate):
+    _require_indexes()
     update_data = {k: v for k, v in tree_update.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    result = await db.trees.update_one(
+    # The pre-image is needed to move rollup counts between species/health
+    before = await tenancy.db().trees.find_one_and_update(
         {"id": tree_id}, 
-        {"$set": update_data}
+        {"$set": update_data},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail="Tree not found")
     
-    tree = await db.trees.find_one({"id": tree_id})
+    tree = {**before, **update_data}
+    await rollups.apply_tree_update(tenancy.db(), before, tree)
+    await tree_lists.bump(tenancy.db(), before, tree)
+    await observations.record(tenancy.db(), [tree], update_data["updated_at"], "update")
     return serialize_doc(tree)
 
+@app.get("/api/trees/{tree_id}/history")
+async def get_tree_history(tree_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    history = await observations.tree_timeline(tenancy.analytics_db(), tree_id, start, end)
+    if not history and not await tenancy.db().trees.find_one({"id": tree_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Tree not found")
+    return history
+
 @app.delete("/api/trees/{tree_id}")
 async def delete_tree(tree_id: str):
-    result = await db.trees.delete_one({"id": tree_id})
-    if result.deleted_count == 0:
+    tree = await tenancy.db().trees.find_one_and_delete({"id": tree_id})
+    if tree is None:
         raise HTTPException(status_code=404, detail="Tree not found")
+    await rollups.apply_tree_delete(tenancy.db(), tree)
+    await tree_lists.bump(tenancy.db(), tree)
     return {"message": "Tree deleted successfully"}
 
 # Work area management endpoints
@@ -178,6 +381,7 @@ async def delete_tree(tree_id: str):
 async def create_work_area(area: WorkAreaCreate):
     area_doc = {
         **area.dict(),
+        **await _boundary_fields(area.boundary),
         "id": str(uuid.uuid4()),
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow(),
@@ -185,59 +389,94 @@ async def create_work_area(area: WorkAreaCreate):
         "last_visit": datetime.utcnow().isoformat()
     }
     
-    result = await db.work_areas.insert_one(area_doc)
+    result = await tenancy.db().work_areas.insert_one(area_doc)
+    await revisions.bump(tenancy.db(), revisions.WORK_AREAS)
     area_doc["_id"] = str(result.inserted_id)
     return serialize_doc(area_doc)
 
 @app.get("/api/work-areas")
-async def get_work_areas():
-    areas = await db.work_areas.find().to_list(None)
-    
-    # Update tree counts for each area
+async def get_work_areas(detail: str = boundaries.WORK_AREA_LIST_DETAIL, bbox: Optional[str] = None):
+    """Work areas with simplified boundaries (detail=full for the originals)"""
+    _check_detail(detail)
+    query = {}
+    if bbox:
+        # Areas whose stored bbox overlaps the viewport
+        min_lat, min_lng, max_lat, max_lng = parse_bbox(bbox)
+        query = {
+            "bbox.min_lat": {"$lte": max_lat}, "bbox.max_lat": {"$gte": min_lat},
+            "bbox.min_lng": {"$lte": max_lng}, "bbox.max_lng": {"$gte": min_lng},
+        }
+    areas = await tenancy.db().work_areas.find(query, boundaries.list_projection(detail)).to_list(None)
+    
+    # Tree counts for all areas in one rollup lookup
+    tree_counts = await rollups.area_tree_counts(tenancy.db(), [area["id"] for area in areas])
     for area in areas:
-        tree_count = await db.trees.count_documents({"area_id": area["id"]})
-        area["tree_count"] = tree_count
+        area["tree_count"] = tree_counts.get(area["id"], 0)
+        boundaries.apply_detail(area, detail)
     
     return serialize_docs(areas)
 
 @app.get("/api/work-areas/{area_id}")
-async def get_work_area(area_id: str):
-    area = await db.work_areas.find_one({"id": area_id})
+async def get_work_area(area_id: str, detail: str = "full"):
+    _check_detail(detail)
+    area = await tenancy.db().work_areas.find_one({"id": area_id}, boundaries.list_projection(detail))
     if not area:
         raise HTTPException(status_code=404, detail="Work area not found")
     
     # Add tree count
-    tree_count = await db.trees.count_documents({"area_id": area_id})
-    area["tree_count"] = tree_count
-    
-    return serialize_doc(area)
+    tree_counts = await rollups.area_tree_counts(tenancy.db(), [area_id])
+    area["tree_count"] = tree_counts.get(area_id, 0)
+    
+    return serialize_doc(boundaries.apply_detail(area, detail))
+
+@app.get("/api/work-areas/{area_id}/trends")
+async def get_work_area_trends(
+    area_id: str,
+    interval: str = "month",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    if interval not in observations.TREND_INTERVALS:
+        raise HTTPException(status_code=400, detail="Invalid interval")
+    return await observations.area_trends(tenancy.analytics_db(), area_id, interval, start, end)
 
 @app.put("/api/work-areas/{area_id}")
 async def update_work_area(area_id: str, area_update: WorkAreaUpdate):
     update_data = {k: v for k, v in area_update.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
-    
-    result = await db.work_areas.update_one(
+    update = {"$set": update_data}
+    if area_update.boundary is not None:
+        update_data.update(await _boundary_fields(area_update.boundary))
+        update["$unset"] = {"boundary_error": ""}
+        if not area_update.boundary:
+            update["$unset"].update(bbox="", centroid="")
+    
+    result = await tenancy.db().work_areas.update_one(
         {"id": area_id}, 
-        {"$set": update_data}
+        update
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Work area not found")
+    await revisions.bump(tenancy.db(), revisions.WORK_AREAS)
     
-    area = await db.work_areas.find_one({"id": area_id})
+    area = await tenancy.db().work_areas.find_one({"id": area_id})
     return serialize_doc(area)
 
 @app.delete("/api/work-areas/{area_id}")
 async def delete_work_area(area_id: str):
-    result = await db.work_areas.delete_one({"id": area_id})
+    result = await tenancy.db().work_areas.delete_one({"id": area_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Work area not found")
+    await revisions.bump(tenancy.db(), revisions.WORK_AREAS)
     return {"message": "Work area deleted successfully"}
 
 # GPS tracking endpoints
 @app.post("/api/gps-tracks")
-async def create_gps_track(track: GPSTrackCreate):
+async def create_gps_track(track: GPSTrackCreate, idempotency_key: Optional[str] = Header(None)):
+    return await _idempotent("gps_tracks", idempotency_key, track.dict(), lambda: _insert_gps_track(track))
+
+async def _insert_gps_track(track: GPSTrackCreate):
     track_doc = {
         **track.dict(),
         "id": str(uuid.uuid4()),
@@ -247,15 +486,9 @@ async def create_gps_track(track: GPSTrackCreate):
     
     # Calculate total distance for path type
     if track.track_type == "path" and len(track.points) > 1:
-        total_distance = 0
-        for i in range(1, len(track.points)):
-            p1 = track.points[i-1]
-            p2 = track.points[i]
-            distance = geodesic((p1["lat"], p1["lng"]), (p2["lat"], p2["lng"])).meters
-            total_distance += distance
-        track_doc["distance"] = total_distance
-    
-    result = await db.gps_tracks.insert_one(track_doc)
+        track_doc["distance"] = await executor.run_blocking(kernels.track_distance, track.points)
+    
+    result = await tenancy.db().gps_tracks.insert_one(track_doc)
     track_doc["_id"] = str(result.inserted_id)
     return serialize_doc(track_doc)
 
@@ -265,75 +498,256 @@ async def get_gps_tracks(track_type: Optional[str] = None):
     if track_type:
         query["track_type"] = track_type
     
-    tracks = await db.gps_tracks.find(query).to_list(None)
+    tracks = await tenancy.db().gps_tracks.find(query).to_list(None)
     return serialize_docs(tracks)
 
 @app.delete("/api/gps-tracks/{track_id}")
 async def delete_gps_track(track_id: str):
-    result = await db.gps_tracks.delete_one({"id": track_id})
+    result = await tenancy.db().gps_tracks.delete_one({"id": track_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="GPS track not found")
     return {"message": "GPS track deleted successfully"}
 
 # Vector layer endpoints
-@app.post("/api/vector-layers")
-async def create_vector_layer(layer: VectorLayerCreate):
+async def _new_vector_layer(name, layer_type, color, visible=True):
     layer_doc = {
-        **layer.dict(),
+        "name": name,
+        "layer_type": layer_type,
+        "color": color,
+        "visible": visible,
         "id": str(uuid.uuid4()),
         "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "updated_at": datetime.utcnow(),
+        "feature_count": 0
     }
+    await tenancy.db().vector_layers.insert_one(layer_doc)
+    return layer_doc["id"]
+
+@app.post("/api/vector-layers")
+async def create_vector_layer(layer: VectorLayerCreate):
+    layer_id = await _new_vector_layer(layer.name, layer.layer_type, layer.color, layer.visible)
+    inserted, skipped = await vector_layers.insert_feature_stream(
+        tenancy.db(), layer_id, layer.layer_type, layer.data
+    )
     
-    result = await db.vector_layers.insert_one(layer_doc)
-    layer_doc["_id"] = str(result.inserted_id)
+    layer_doc = await tenancy.db().vector_layers.find_one({"id": layer_id})
+    layer_doc["skipped_features"] = skipped
+    return serialize_doc(layer_doc)
+
+@app.post("/api/vector-layers/import")
+async def import_vector_layer(
+    file: UploadFile = File(...),
+    name: Optional[str] = Form(None),
+    color: str = Form("#3B82F6"),
+    layer_type: Optional[str] = Form(None)
+):
+    """Create a layer from a GeoJSON FeatureCollection or a zipped Shapefile"""
+    filename = file.filename or ""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ""
+    if extension not in ["geojson", "json", "zip"]:
+        raise HTTPException(status_code=400, detail="Upload a .geojson/.json file or a zipped Shapefile")
+    
+    temp_path = None
+    layer_id = None
+    try:
+        if extension == "zip":
+            # pyshp needs a seekable file on disk
+            with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as temp:
+                temp_path = temp.name
+                await asyncio.to_thread(shutil.copyfileobj, file.file, temp)
+            features = vector_layers.iter_shapefile_features(temp_path)
+        else:
+            features = vector_layers.iter_geojson_features(file.file)
+        
+        detected_type, features = await vector_layers.peek_layer_type(features)
+        layer_id = await _new_vector_layer(
+            name or filename.rsplit('.', 1)[0], layer_type or detected_type or "polygon", color
+        )
+        inserted, skipped = await vector_layers.insert_feature_stream(
+            tenancy.db(), layer_id, layer_type or detected_type, features
+        )
+    except BaseException as e:
+        # Don't leave a half-imported layer behind, even when the request is cancelled
+        if layer_id:
+            await asyncio.shield(_discard_vector_layer(layer_id))
+        if isinstance(e, vector_layers.import_errors()):
+            raise HTTPException(status_code=400, detail=f"Could not read vector file: {e}")
+        raise
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+    
+    layer_doc = await tenancy.db().vector_layers.find_one({"id": layer_id})
+    layer_doc["skipped_features"] = skipped
     return serialize_doc(layer_doc)
 
+async def _discard_vector_layer(layer_id: str):
+    await tenancy.db().vector_layers.delete_one({"id": layer_id})
+    await tenancy.db().vector_features.delete_many({"layer_id": layer_id})
+
 @app.get("/api/vector-layers")
 async def get_vector_layers():
-    layers = await db.vector_layers.find().to_list(None)
+    layers = await vector_layers.list_layers(tenancy.db())
     return serialize_docs(layers)
 
+@app.get("/api/vector-layers/{layer_id}")
+async def get_vector_layer(layer_id: str):
+    layer = await tenancy.db().vector_layers.find_one({"id": layer_id}, {"data": 0})
+    if not layer:
+        raise HTTPException(status_code=404, detail="Vector layer not found")
+    return serialize_doc(layer)
+
+@app.get("/api/vector-layers/{layer_id}/features")
+async def get_vector_layer_features(
+    layer_id: str,
+    bbox: Optional[str] = None,
+    limit: int = vector_layers.VECTOR_FEATURE_LIMIT
+):
+    """GeoJSON FeatureCollection of the layer's features intersecting bbox"""
+    bounds = parse_bbox(bbox) if bbox else None
+    if not await tenancy.db().vector_layers.find_one({"id": layer_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Vector layer not found")
+    limit = max(1, min(limit, vector_layers.VECTOR_FEATURE_LIMIT))
+    return await vector_layers.features_in_bbox(tenancy.db(), layer_id, bounds, limit)
+
 @app.delete("/api/vector-layers/{layer_id}")
 async def delete_vector_layer(layer_id: str):
-    result = await db.vector_layers.delete_one({"id": layer_id})
+    result = await tenancy.db().vector_layers.delete_one({"id": layer_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Vector layer not found")
+    await tenancy.db().vector_features.delete_many({"layer_id": layer_id})
     return {"message": "Vector layer deleted successfully"}
 
 # Photo upload endpoint
 @app.post("/api/trees/{tree_id}/photos")
 async def upload_tree_photo(tree_id: str, file: UploadFile = File(...)):
     # Verify tree exists
-    tree = await db.trees.find_one({"id": tree_id})
+    tree = await tenancy.db().trees.find_one({"id": tree_id})
     if not tree:
         raise HTTPException(status_code=404, detail="Tree not found")
     
     # Save uploaded file
-    file_extension = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-    filename = f"{tree_id}_{uuid.uuid4()}.{file_extension}"
+    filename = _photo_filename(tree_id, file.filename)
     file_path = f"uploads/{filename}"
     
     async with aiofiles.open(file_path, 'wb') as f:
         content = await file.read()
         await f.write(content)
     
-    # Update tree document with photo info
+    return await _add_photo(tree_id, filename, len(content))
+
+def _photo_filename(tree_id: str, original: Optional[str]):
+    file_extension = original.split('.')[-1] if original and '.' in original else 'jpg'
+    return f"{tree_id}_{uuid.uuid4()}.{file_extension}"
+
+async def _add_photo(tree_id: str, filename: str, size: int):
+    """Record a photo already saved in uploads/ on its tree"""
     photo_info = {
         "id": str(uuid.uuid4()),
         "filename": filename,
-        "file_path": file_path,
+        "file_path": f"uploads/{filename}",
         "uploaded_at": datetime.utcnow().isoformat(),
-        "size": len(content)
+        "size": size
     }
     
-    await db.trees.update_one(
+    tree = await tenancy.db().trees.find_one_and_update(
         {"id": tree_id},
-        {"$push": {"photos": photo_info}}
+        {"$push": {"photos": photo_info}},
+        projection={"area_id": 1}
     )
+    await tree_lists.bump(tenancy.db(), tree)
     
     return photo_info
 
+# Resumable upload endpoints
+async def _get_upload_session(upload_id: str):
+    session = await tenancy.db().upload_sessions.find_one({"id": upload_id})
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+def _upload_status(session):
+    return {"id": session["id"], "kind": session["kind"], "offset": session["offset"],
+            "length": session["length"], "state": session["state"]}
+
+@app.post("/api/uploads")
+async def create_upload(upload: UploadCreate):
+    """Open a resumable upload session for a photo or a GPS track JSON file"""
+    if upload.kind not in resumable.UPLOAD_KINDS:
+        raise HTTPException(status_code=400, detail="Invalid upload kind")
+    if not 0 < upload.length <= resumable.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Invalid upload length")
+    if upload.kind == "photo":
+        if not upload.tree_id or not await tenancy.db().trees.find_one({"id": upload.tree_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Tree not found")
+    
+    session = await resumable.create_session(
+        tenancy.db(), upload.kind, upload.length,
+        {"filename": upload.filename, "tree_id": upload.tree_id}
+    )
+    return _upload_status(session)
+
+@app.get("/api/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    return _upload_status(await _get_upload_session(upload_id))
+
+@app.patch("/api/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, upload_offset: int = Header(...)):
+    """Write the raw request body at Upload-Offset"""
+    session = await _get_upload_session(upload_id)
+    if session["state"] != "open":
+        raise HTTPException(status_code=409, detail="Upload is already finalized")
+    try:
+        session["offset"] = await resumable.write_chunk(tenancy.db(), session, upload_offset, request.stream())
+    except resumable.OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except resumable.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return _upload_status(session)
+
+@app.post("/api/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    """Create the photo or GPS track; repeated calls return the same result"""
+    session = await _get_upload_session(upload_id)
+    if session["state"] == "done":
+        return session["result"]
+    if session["offset"] != session["length"]:
+        raise HTTPException(status_code=409, detail="Upload is incomplete")
+    claimed_at = await resumable.claim_finalize(tenancy.db(), upload_id)
+    if claimed_at is None:
+        raise HTTPException(status_code=409, detail="Upload is already being finalized")
+    
+    try:
+        # Keyed by the session, so finalizing again after a crash cannot create a second photo or track
+        result = await _idempotent(
+            "uploads", upload_id, {"upload_id": upload_id}, lambda: _create_from_upload(session)
+        )
+        await resumable.complete(tenancy.db(), upload_id, result)
+    except BaseException:
+        await asyncio.shield(resumable.release_finalize(tenancy.db(), upload_id, claimed_at))
+        raise
+    return result
+
+async def _create_from_upload(session):
+    upload_id = session["id"]
+    if session["kind"] == "photo":
+        tree_id = session["metadata"]["tree_id"]
+        if not await tenancy.db().trees.find_one({"id": tree_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Tree not found")
+        filename = _photo_filename(tree_id, session["metadata"].get("filename"))
+        os.replace(resumable.part_path(upload_id), f"uploads/{filename}")
+        try:
+            return await _add_photo(tree_id, filename, session["length"])
+        except BaseException:
+            # Put the bytes back so the reopened session can be finalized again
+            os.replace(f"uploads/{filename}", resumable.part_path(upload_id))
+            raise
+    try:
+        track = GPSTrackCreate(**await asyncio.to_thread(resumable.load_json, upload_id))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid GPS track file")
+    return await _insert_gps_track(track)
+
 # Measurement endpoints
 @app.post("/api/measurements")
 async def create_measurement(measurement: MeasurementCreate):
@@ -343,31 +757,45 @@ async def create_measurement(measurement: MeasurementCreate):
         "created_at": datetime.utcnow()
     }
     
-    result = await db.measurements.insert_one(measurement_doc)
+    result = await tenancy.db().measurements.insert_one(measurement_doc)
     measurement_doc["_id"] = str(result.inserted_id)
     return serialize_doc(measurement_doc)
 
 @app.get("/api/measurements")
 async def get_measurements():
-    measurements = await db.measurements.find().to_list(None)
+    measurements = await tenancy.db().measurements.find().to_list(None)
     return serialize_docs(measurements)
 
+@app.get("/api/measurements/{measurement_id}/nearby-trees")
+async def get_measurement_nearby_trees(
+    measurement_id: str,
+    radius: float = 30,
+    point: str = "end",
+    k: int = proximity.PROXIMITY_MAX_K
+):
+    """Trees within `radius` meters of the measurement's start or end point"""
+    if point not in ["start", "end"]:
+        raise HTTPException(status_code=400, detail="point must be start or end")
+    _check_k(k)
+    measurement = await tenancy.db().measurements.find_one({"id": measurement_id})
+    if not measurement:
+        raise HTTPException(status_code=404, detail="Measurement not found")
+    
+    target = measurement[f"{point}_point"]
+    trees = await proximity.nearest_trees(tenancy.db(), target["lat"], target["lng"], k, radius)
+    return serialize_docs(trees)
+
 # Analytics endpoints
 @app.get("/api/analytics/summary")
 async def get_analytics_summary():
-    total_trees = await db.trees.count_documents({})
-    healthy_trees = await db.trees.count_documents({"health": "healthy"})
-    warning_trees = await db.trees.count_documents({"health": "warning"})
-    critical_trees = await db.trees.count_documents({"health": "critical"})
-    total_areas = await db.work_areas.count_documents({})
-    total_tracks = await db.gps_tracks.count_documents({})
-    total_measurements = await db.measurements.count_documents({})
+    tree_counts = await rollups.summary_counts(tenancy.analytics_db())
+    # Counts of the organization's documents, covered by the (org_id, id) indexes
+    total_areas = await tenancy.analytics_db().work_areas.count_documents({})
+    total_tracks = await tenancy.analytics_db().gps_tracks.count_documents({})
+    total_measurements = await tenancy.analytics_db().measurements.count_documents({})
     
     return {
-        "total_trees": total_trees,
-        "healthy_trees": healthy_trees,
-        "warning_trees": warning_trees,
-        "critical_trees": critical_trees,
+        **tree_counts,
         "total_areas": total_areas,
         "total_tracks": total_tracks,
         "total_measurements": total_measurements
@@ -375,13 +803,77 @@ async def get_analytics_summary():
 
 @app.get("/api/analytics/species-distribution")
 async def get_species_distribution():
-    pipeline = [
-        {"$group": {"_id": "$species", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]
-    
-    result = await db.trees.aggregate(pipeline).to_list(None)
-    return [{"species": doc["_id"], "count": doc["count"]} for doc in result]
+    return await rollups.species_distribution(tenancy.analytics_db())
+
+@app.get("/api/analytics/trees-per-day")
+async def get_trees_per_day(start: Optional[str] = None, end: Optional[str] = None):
+    return await rollups.daily_counts(tenancy.analytics_db(), start, end)
+
+@app.get("/api/analytics/stands")
+async def get_stand_metrics(area_ids: Optional[str] = None):
+    """Stand density, basal area, volume and species mix per work area"""
+    ids = area_ids.split(",") if area_ids else None
+    return await stands.area_stand_metrics(tenancy.analytics_db(), ids)
+
+@app.get("/api/analytics/stands/{area_id}")
+async def get_area_stand_metrics(area_id: str):
+    result = await stands.area_stand_metrics(tenancy.analytics_db(), [area_id])
+    if not result:
+        raise HTTPException(status_code=404, detail="Work area not found")
+    return result[0]
+
+@app.post("/api/analytics/stands/polygon")
+async def get_polygon_stand_metrics(polygon: StandPolygon):
+    if len(polygon.boundary) < 3 or any(len(point) < 2 for point in polygon.boundary):
+        raise HTTPException(status_code=400, detail="Boundary needs at least 3 [lat, lng] points")
+    return await stands.polygon_stand_metrics(tenancy.analytics_db(), polygon.boundary)
+
+@app.get("/api/analytics/heatmap")
+async def get_heatmap(
+    bbox: str,
+    cell_size: float = 50,
+    metric: str = "density",
+    format: str = "png"
+):
+    """Rasterize trees in `bbox` (min_lat,min_lng,max_lat,max_lng) into cell_size-meter cells
+
+    `density` is trees per cell; `health` is the mean health score per cell
+    (0 healthy, 1 warning, 2 critical, NaN without trees). `bin` returns the
+    raw float32 grid, north row first, with its shape in X-Grid-* headers.
+    """
+    if metric not in heatmap.METRICS:
+        raise HTTPException(status_code=400, detail="Invalid metric")
+    if format not in ["png", "bin"]:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    if cell_size <= 0:
+        raise HTTPException(status_code=400, detail="Invalid cell_size")
+    
+    bounds = parse_bbox(bbox)
+    try:
+        grid = await heatmap.bbox_grid(tenancy.analytics_db(), bounds, cell_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    values = grid.values(metric)
+    headers = {
+        "X-Grid-Rows": str(grid.rows),
+        "X-Grid-Cols": str(grid.cols),
+        "X-Grid-BBox": ",".join(str(v) for v in bounds)
+    }
+    if format == "png":
+        content = await executor.run_blocking(heatmap.encode_png, values, metric)
+        return Response(content=content, media_type="image/png", headers=headers)
+    headers["X-Grid-Dtype"] = "float32"
+    return Response(content=heatmap.encode_binary(values), media_type="application/octet-stream", headers=headers)
+
+@app.get("/api/analytics/heatmap/tiles/{z}/{x}/{y}.png")
+async def get_heatmap_tile(z: int, x: int, y: int, metric: str = "density"):
+    if metric not in heatmap.METRICS:
+        raise HTTPException(status_code=400, detail="Invalid metric")
+    if not (0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Invalid tile coordinates")
+    content = await heatmap.tile_png(tenancy.analytics_db(), metric, z, x, y)
+    return Response(content=content, media_type="image/png")
 
 # Report generation endpoint
 @app.get("/api/reports/generate/{report_type}")
@@ -390,88 +882,20 @@ async def generate_report(report_type: str, area_id: Optional[str] = None):
         raise HTTPException(status_code=400, detail="Invalid report type")
     
     # Generate PDF report
-    filename = f"report_{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    generated_at = datetime.now()
+    filename = f"report_{report_type}_{generated_at.strftime('%Y%m%d_%H%M%S')}.pdf"
     file_path = f"uploads/{filename}"
     
-    doc = SimpleDocTemplate(file_path, pagesize=A4)
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Title
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        alignment=1  # Center alignment
-    )
-    story.append(Paragraph("森林管理レポート", title_style))
-    story.append(Spacer(1, 12))
-    
     # Get data based on report type
+    analytics = None
+    trees = None
     if report_type in ["summary", "full"]:
         analytics = await get_analytics_summary()
-        
-        data = [
-            ["項目", "値"],
-            ["総樹木数", str(analytics["total_trees"])],
-            ["健康な樹木", str(analytics["healthy_trees"])],
-            ["要注意樹木", str(analytics["warning_trees"])],
-            ["作業エリア数", str(analytics["total_areas"])],
-            ["GPS軌跡数", str(analytics["total_tracks"])],
-        ]
-        
-        table = Table(data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        story.append(Paragraph("概要統計", styles['Heading2']))
-        story.append(table)
-        story.append(Spacer(1, 12))
-    
     if report_type in ["trees", "full"]:
-        trees = await get_trees(area_id=area_id)
-        
-        if trees:
-            story.append(Paragraph("樹木一覧", styles['Heading2']))
-            tree_data = [["ID", "樹種", "健康状態", "直径(cm)", "高さ(m)"]]
-            
-            for tree in trees[:20]:  # Limit to 20 trees for PDF
-                tree_data.append([
-                    tree.get("id", "")[:8],
-                    tree.get("species", ""),
-                    tree.get("health", ""),
-                    str(tree.get("diameter", 0)),
-                    str(tree.get("height", 0))
-                ])
-            
-            tree_table = Table(tree_data)
-            tree_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            story.append(tree_table)
-    
-    # Generate timestamp
-    story.append(Spacer(1, 20))
-    story.append(Paragraph(f"生成日時: {datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')}", styles['Normal']))
-    
-    doc.build(story)
+        query = {"area_id": area_id} if area_id else {}
+        trees = serialize_docs(await tenancy.analytics_db().trees.find(query).to_list(None))
+    
+    await executor.run_blocking(kernels.build_report_pdf, file_path, generated_at, analytics, trees)
     
     return FileResponse(
         file_path,
@@ -479,6 +903,12 @@ async def generate_report(report_type: str, area_id: Optional[str] = None):
         filename=filename
     )
 
+# Scheduler endpoints
+@app.get("/api/scheduler/jobs")
+async def get_scheduler_jobs():
+    """Leader, job intervals and the last run of each background job"""
+    return await app.state.scheduler.status()
+
 # Data export endpoints
 @app.get("/api/export/{format}")
 async def export_data(format: str):
@@ -486,9 +916,9 @@ async def export_data(format: str):
         raise HTTPException(status_code=400, detail="Invalid export format")
     
     # Get all data
-    trees = await db.trees.find().to_list(None)
-    areas = await db.work_areas.find().to_list(None)
-    tracks = await db.gps_tracks.find().to_list(None)
+    trees = await tenancy.analytics_db().trees.find().to_list(None)
+    areas = await tenancy.analytics_db().work_areas.find().to_list(None)
+    tracks = await tenancy.analytics_db().gps_tracks.find().to_list(None)
     
     export_data = {
         "trees": serialize_docs(trees),
@@ -501,18 +931,11 @@ async def export_data(format: str):
     file_path = f"uploads/{filename}"
     
     if format == "json":
-        async with aiofiles.open(file_path, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(export_data, ensure_ascii=False, indent=2))
+        await executor.run_blocking(kernels.write_json_export, file_path, export_data)
         media_type = "application/json"
     
     elif format == "csv":
-        # Convert trees to CSV
-        df = pd.DataFrame(export_data["trees"])
-        if not df.empty:
-            # Remove complex fields for CSV
-            df = df.drop(columns=["photos"], errors="ignore")
-        
-        df.to_csv(file_path, index=False, encoding='utf-8-sig')
+        await executor.run_blocking(kernels.write_csv_export, file_path, export_data["trees"])
         media_type = "text/csv"
     
     return FileResponse(
@@ -523,4 +946,4 @@ async def export_data(format: str):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run("server:app", host=HOST, port=PORT, workers=WEB_CONCURRENCY)
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""Stand metrics per work area or arbitrary polygon
+
+For each stand: trees per hectare, basal area (m²/ha) from `diameter`
+(DBH in cm), estimated stem volume (m³/ha) as basal area * `height` *
+STAND_FORM_FACTOR, and species mix.
+
+Work areas are computed together: one aggregation groups every tree by
+area and species, and areas are the `area_ha` stored with each boundary
+(see boundaries.py). Results are cached under the current data revisions, so
+repeated dashboard loads are free until a tree or work area changes. The
+revisions and the data are read in one causally consistent session, so
+data older than the revision it is cached under is never read from a
+lagging secondary.
+"""
+import math
+import os
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+import executor
+import geometry
+import mongo
+import revisions
+
+STAND_FORM_FACTOR = float(os.getenv("STAND_FORM_FACTOR", "0.45"))
+STAND_CHUNK_SIZE = int(os.getenv("STAND_CHUNK_SIZE", "20000"))
+STAND_CACHE_SIZE = int(os.getenv("STAND_CACHE_SIZE", "64"))
+
+# π/4 * (d/100)² with d in cm gives basal area in m²
+BASAL_AREA_COEFF = math.pi / 40000
+
+_cache = OrderedDict()
+
+
+def _cache_get(key):
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+    return None
+
+
+def _cache_put(key, value):
+    _cache[key] = value
+    _cache.move_to_end(key)
+    while len(_cache) > STAND_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def _per_ha(value, area_ha):
+    return value / area_ha if area_ha else None
+
+
+def _stand_result(area_ha, trees, basal_area, volume, species_counts):
+    species_mix = sorted(species_counts.items(), key=lambda item: -item[1])
+    return {
+        "area_ha": area_ha,
+        "trees": trees,
+        "trees_per_ha": _per_ha(trees, area_ha),
+        "basal_area_m2": basal_area,
+        "basal_area_m2_per_ha": _per_ha(basal_area, area_ha),
+        "volume_m3": volume,
+        "volume_m3_per_ha": _per_ha(volume, area_ha),
+        "species_mix": [
+            {"species": species, "trees": count, "share": count / trees if trees else 0}
+            for species, count in species_mix
+        ],
+    }
+
+
+async def area_stand_metrics(db, area_ids=None):
+    """Stand metrics for the given work areas (all areas when None)"""
+    async with await mongo.causal_session() as session:
+        return await _area_stand_metrics(db, area_ids, session)
+
+
+async def _area_stand_metrics(db, area_ids, session):
+    revision = await revisions.current(db, revisions.TREES, revisions.WORK_AREAS, session=session)
+    key = (db.org_id, "areas", revision, tuple(sorted(area_ids)) if area_ids is not None else None)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    area_query = {"id": {"$in": area_ids}} if area_ids is not None else {}
+    areas = await db.work_areas.find(
+        area_query, {"_id": 0, "id": 1, "name": 1, "area_ha": 1}, session=session
+    ).to_list(None)
+    tree_match = {"area_id": {"$in": [area["id"] for area in areas]}} if area_ids is not None \
+        else {"area_id": {"$nin": [None, ""]}}
+
+    diameter = {"$ifNull": ["$diameter", 0]}
+    height = {"$ifNull": ["$height", 0]}
+    basal_area = {"$multiply": [BASAL_AREA_COEFF, diameter, diameter]}
+    pipeline = [
+        {"$match": tree_match},
+        {"$group": {
+            "_id": {"area_id": "$area_id", "species": "$species"},
+            "trees": {"$sum": 1},
+            "basal_area": {"$sum": basal_area},
+            "volume": {"$sum": {"$multiply": [basal_area, height, STAND_FORM_FACTOR]}},
+        }},
+        {"$group": {
+            "_id": "$_id.area_id",
+            "trees": {"$sum": "$trees"},
+            "basal_area": {"$sum": "$basal_area"},
+            "volume": {"$sum": "$volume"},
+            "species": {"$push": {"species": "$_id.species", "trees": "$trees"}},
+        }},
+    ]
+    rows = {row["_id"]: row for row in await db.trees.aggregate(pipeline, session=session).to_list(None)}
+
+    results = []
+    for area in areas:
+        area_ha = area.get("area_ha", 0)
+        row = rows.get(area["id"], {"trees": 0, "basal_area": 0, "volume": 0, "species": []})
+        species_counts = Counter({item["species"]: item["trees"] for item in row["species"]})
+        results.append({
+            "area_id": area["id"],
+            "name": area.get("name"),
+            **_stand_result(float(area_ha), row["trees"], row["basal_area"], row["volume"], species_counts),
+        })
+
+    _cache_put(key, results)
+    return results
+
+
+def _chunk_totals(boundary, chunk):
+    """Totals for the trees of one cursor chunk that fall inside `boundary`"""
+    lats = np.fromiter((doc.get("lat", np.nan) for doc in chunk), dtype=float, count=len(chunk))
+    lngs = np.fromiter((doc.get("lng", np.nan) for doc in chunk), dtype=float, count=len(chunk))
+    diameters = np.fromiter((doc.get("diameter") or 0 for doc in chunk), dtype=float, count=len(chunk))
+    heights = np.fromiter((doc.get("height") or 0 for doc in chunk), dtype=float, count=len(chunk))
+
+    inside = geometry.points_in_polygon(lats, lngs, boundary)
+    basal_area = BASAL_AREA_COEFF * diameters[inside] ** 2
+    volume = basal_area * heights[inside] * STAND_FORM_FACTOR
+    species = Counter(chunk[i].get("species") for i in np.flatnonzero(inside))
+    return int(inside.sum()), float(basal_area.sum()), float(volume.sum()), species
+
+
+async def polygon_stand_metrics(db, boundary):
+    """Stand metrics for an arbitrary [[lat, lng], ...] polygon"""
+    async with await mongo.causal_session() as session:
+        return await _polygon_stand_metrics(db, boundary, session)
+
+
+async def _polygon_stand_metrics(db, boundary, session):
+    revision = await revisions.current(db, revisions.TREES, session=session)
+    key = (db.org_id, "polygon", revision, tuple(tuple(point[:2]) for point in boundary))
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    min_lat, min_lng, max_lat, max_lng = geometry.bbox(boundary)
+    cursor = db.trees.find(
+        {"lat": {"$gte": min_lat, "$lte": max_lat}, "lng": {"$gte": min_lng, "$lte": max_lng}},
+        {"_id": 0, "lat": 1, "lng": 1, "diameter": 1, "height": 1, "species": 1},
+        session=session,
+    ).batch_size(STAND_CHUNK_SIZE)
+
+    trees, basal_area, volume, species_counts = 0, 0.0, 0.0, Counter()
+
+    async def flush(chunk):
+        nonlocal trees, basal_area, volume
+        n, ba, vol, species = await executor.run_blocking(_chunk_totals, boundary, chunk)
+        trees += n
+        basal_area += ba
+        volume += vol
+        species_counts.update(species)
+
+    chunk = []
+    async for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= STAND_CHUNK_SIZE:
+            await flush(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+
+    area_ha = float(geometry.polygon_areas_ha([boundary])[0])
+    result = _stand_result(area_ha, trees, basal_area, volume, species_counts)
+    _cache_put(key, result)
+    return result
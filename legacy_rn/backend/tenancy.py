@@ -0,0 +1,280 @@
+"""Multi-tenant scoping by organization (regional office)
+
+Every tenant document carries the `org_id` of the office that owns it and
+every index on tenant collections leads with it. Requests name their
+organization in the X-Org-Id header (DEFAULT_ORG_ID when absent, unless
+TENANT_REQUIRED). Handlers reach Mongo through `db()` / `analytics_db()`,
+whose collections add the org_id condition to every filter and pipeline
+and stamp it on every written document, so a query cannot touch another
+office's data by forgetting a condition. Collections without org_id
+(scheduler_locks, scheduler_jobs) are only reached through mongo.db.
+
+Offices listed in TENANT_DATABASES ("*" for all) get their own database,
+DATABASE_NAME_<org_id>, the unit we can later place on its own shard.
+Scoping is identical in both layouts. A new office's database is created
+by its first write, between index maintenance runs, so each process
+prepares a dedicated database (indexes, time-series collection) the first
+time a request uses it.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import re
+
+from fastapi.responses import JSONResponse
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+
+import mongo
+
+DEFAULT_ORG_ID = os.getenv("DEFAULT_ORG_ID", "default")
+TENANT_REQUIRED = os.getenv("TENANT_REQUIRED", "0").lower() in ("1", "true", "yes")
+TENANT_DATABASES = {org.strip() for org in os.getenv("TENANT_DATABASES", "").split(",") if org.strip()}
+
+ORG_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,48}$")
+# Mongo database names must be shorter than 64 characters
+DATABASE_NAME_MAX_LENGTH = 63
+
+TENANT_COLLECTIONS = [
+    "trees", "work_areas", "gps_tracks", "vector_layers", "vector_features", "measurements",
+    "analytics_rollups", "revisions", "tree_observations", "idempotency_keys", "upload_sessions",
+]
+# Time-series collections only index their metaField efficiently
+TENANT_FIELDS = {"tree_observations": "meta.org_id"}
+
+_current_org = contextvars.ContextVar("org_id", default=DEFAULT_ORG_ID)
+
+logger = logging.getLogger("tenancy")
+
+
+class TenantCollection:
+    """The subset of the Motor collection API the handlers use, scoped to one org"""
+
+    def __init__(self, collection, org_id, field="org_id"):
+        self._collection = collection
+        self.org_id = org_id
+        self.field = field
+
+    def _filter(self, filter=None):
+        return {**(filter or {}), self.field: self.org_id}
+
+    def _stamp(self, doc):
+        if self.field == "org_id":
+            doc["org_id"] = self.org_id
+        else:
+            outer, inner = self.field.split(".")
+            doc[outer] = {**(doc.get(outer) or {}), inner: self.org_id}
+        return doc
+
+    def _pipeline(self, pipeline):
+        if pipeline and "$geoNear" in pipeline[0]:
+            # $geoNear must stay the first stage
+            geo_near = pipeline[0]["$geoNear"]
+            return [{"$geoNear": {**geo_near, "query": self._filter(geo_near.get("query"))}}, *pipeline[1:]]
+        return [{"$match": self._filter()}, *pipeline]
+
+    def _operation(self, op):
+        # Scope the bulk operation in place, keeping its other options
+        if isinstance(op, InsertOne):
+            self._stamp(op._doc)
+        elif isinstance(op, (UpdateOne, UpdateMany, DeleteOne, DeleteMany)):
+            op._filter = self._filter(op._filter)
+        elif isinstance(op, ReplaceOne):
+            op._filter = self._filter(op._filter)
+            self._stamp(op._doc)
+        else:
+            raise TypeError(f"Unsupported bulk operation {op!r}")
+        return op
+
+    def find(self, filter=None, *args, **kwargs):
+        return self._collection.find(self._filter(filter), *args, **kwargs)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        return self._collection.find_one(self._filter(filter), *args, **kwargs)
+
+    def count_documents(self, filter=None, **kwargs):
+        return self._collection.count_documents(self._filter(filter), **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return self._collection.aggregate(self._pipeline(pipeline), **kwargs)
+
+    def insert_one(self, doc, **kwargs):
+        return self._collection.insert_one(self._stamp(doc), **kwargs)
+
+    def insert_many(self, docs, **kwargs):
+        return self._collection.insert_many([self._stamp(doc) for doc in docs], **kwargs)
+
+    def update_one(self, filter, update, **kwargs):
+        return self._collection.update_one(self._filter(filter), update, **kwargs)
+
+    def update_many(self, filter, update, **kwargs):
+        return self._collection.update_many(self._filter(filter), update, **kwargs)
+
+    def delete_one(self, filter, **kwargs):
+        return self._collection.delete_one(self._filter(filter), **kwargs)
+
+    def delete_many(self, filter, **kwargs):
+        return self._collection.delete_many(self._filter(filter), **kwargs)
+
+    def find_one_and_update(self, filter, update, **kwargs):
+        return self._collection.find_one_and_update(self._filter(filter), update, **kwargs)
+
+    def find_one_and_delete(self, filter, **kwargs):
+        return self._collection.find_one_and_delete(self._filter(filter), **kwargs)
+
+    def bulk_write(self, requests, **kwargs):
+        return self._collection.bulk_write([self._operation(op) for op in requests], **kwargs)
+
+
+class TenantDatabase:
+    def __init__(self, database, org_id):
+        self._database = database
+        self.org_id = org_id
+        self.name = database.name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in TENANT_COLLECTIONS:
+            raise AttributeError(f"{name} is not a tenant collection")
+        if name not in self._collections:
+            self._collections[name] = TenantCollection(
+                self._database[name], self.org_id, TENANT_FIELDS.get(name, "org_id")
+            )
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+def valid_org_id(org_id):
+    if not ORG_ID_PATTERN.match(org_id):
+        return False
+    return not has_own_database(org_id) or len(database_name(org_id)) <= DATABASE_NAME_MAX_LENGTH
+
+
+def has_own_database(org_id):
+    return "*" in TENANT_DATABASES or org_id in TENANT_DATABASES
+
+
+def database_name(org_id):
+    return f"{mongo.DATABASE_NAME}_{org_id}" if has_own_database(org_id) else mongo.DATABASE_NAME
+
+
+def db_for(org_id, analytics=False):
+    """Scoped database of an organization (analytics reads use the analytics read preference)"""
+    base = mongo.analytics_db if analytics else mongo.db
+    if has_own_database(org_id):
+        base = mongo.client.get_database(database_name(org_id), read_preference=base.read_preference)
+    return TenantDatabase(base, org_id)
+
+
+def current_org():
+    return _current_org.get()
+
+
+def db():
+    return db_for(current_org())
+
+
+def analytics_db():
+    return db_for(current_org(), analytics=True)
+
+
+def scoped_id(db, value):
+    """Tenant-unique _id for collections keyed by a name (rollups, revisions, ...)"""
+    return f"{db.org_id}:{value}"
+
+
+async def databases():
+    """The shared database plus every dedicated tenant database"""
+    names = {mongo.DATABASE_NAME}
+    if "*" in TENANT_DATABASES:
+        prefix = f"{mongo.DATABASE_NAME}_"
+        names.update(name for name in await mongo.client.list_database_names() if name.startswith(prefix))
+    else:
+        names.update(database_name(org_id) for org_id in TENANT_DATABASES)
+    return [mongo.client[name] for name in sorted(names)]
+
+
+async def organizations():
+    """Every org_id that owns trees or work areas"""
+    orgs = set()
+    for database in await databases():
+        for collection in ("trees", "work_areas"):
+            orgs.update(org for org in await database[collection].distinct("org_id") if org)
+    if "*" not in TENANT_DATABASES:
+        orgs.update(TENANT_DATABASES)
+    return sorted(orgs)
+
+
+_prepared_databases = set()
+_preparing = {}
+
+
+async def _prepare_database(name):
+    import jobs  # jobs imports this module
+
+    database = mongo.client[name]
+    # Databases that existed at startup were prepared by readiness
+    if "tree_observations" not in await database.list_collection_names():
+        logger.info("Preparing new tenant database %s", name)
+        await jobs.ensure_database(database)
+    _prepared_databases.add(name)
+
+
+async def prepare_database(org_id):
+    """Make sure a dedicated database has its indexes before it is used (memoized per process)"""
+    name = database_name(org_id)
+    if name in _prepared_databases:
+        return
+    task = _preparing.get(name)
+    if task is None:
+        task = _preparing[name] = asyncio.ensure_future(_prepare_database(name))
+        task.add_done_callback(lambda _: _preparing.pop(name, None))
+    # Shielded: one cancelled request must not abort the preparation others await
+    await asyncio.shield(task)
+
+
+async def backfill_org_ids(database):
+    """Assign documents written before tenancy to DEFAULT_ORG_ID"""
+    for name in TENANT_COLLECTIONS:
+        field = TENANT_FIELDS.get(name, "org_id")
+        await database[name].update_many({field: {"$exists": False}}, {"$set": {field: DEFAULT_ORG_ID}})
+
+
+class TenantMiddleware:
+    """Pure ASGI middleware binding the request's X-Org-Id to the handlers' context"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        org_id = dict(scope["headers"]).get(b"x-org-id", b"").decode("latin-1")
+        scoped = scope["path"].startswith("/api/") and scope["path"] not in ("/api/health", "/api/ready")
+        error = None
+        if not org_id and TENANT_REQUIRED and scoped:
+            error = "X-Org-Id header is required"
+        elif org_id and not valid_org_id(org_id):
+            error = "Invalid X-Org-Id"
+        if error:
+            return await JSONResponse({"detail": error}, status_code=400)(scope, receive, send)
+
+        org_id = org_id or DEFAULT_ORG_ID
+        if scoped and has_own_database(org_id):
+            try:
+                await prepare_database(org_id)
+            except Exception:
+                logger.exception("Preparing the database of %s failed", org_id)
+                response = JSONResponse({"detail": "Organization database is not available"}, status_code=503)
+                return await response(scope, receive, send)
+
+        token = _current_org.set(org_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_org.reset(token)
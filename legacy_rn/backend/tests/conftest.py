@@ -0,0 +1,231 @@
+import asyncio
+import copy
+import os
+import sys
+
+import pytest
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def _matches_condition(value, present, condition):
+    if not isinstance(condition, dict) or not any(op.startswith("$") for op in condition):
+        return present and value == condition
+    for op, arg in condition.items():
+        if op == "$in" and not (present and value in arg):
+            return False
+        if op == "$nin" and present and value in arg:
+            return False
+        if op == "$exists" and present != arg:
+            return False
+        if op == "$lt" and not (present and value < arg):
+            return False
+        if op == "$gte" and not (present and value >= arg):
+            return False
+        if op == "$lte" and not (present and value <= arg):
+            return False
+    return True
+
+
+def matches(doc, filter):
+    """The subset of Mongo query semantics the scoped modules use"""
+    for key, condition in (filter or {}).items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif key == "$expr":
+            a, b = condition["$eq"]
+            if _get(doc, a[1:])[0] != _get(doc, b[1:])[0]:
+                return False
+        elif not _matches_condition(*_get(doc, key), condition):
+            return False
+    return True
+
+
+class UpdateResult:
+    def __init__(self, matched_count, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = matched_count
+        self.upserted_id = upserted_id
+
+
+class DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        self._docs.sort(key=lambda doc: _get(doc, key)[0], reverse=direction < 0)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    async def to_list(self, length):
+        return self._docs if length is None else self._docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+
+class FakeCollection:
+    """In-memory stand-in for the Motor collection methods TenantCollection forwards to"""
+
+    def __init__(self, name):
+        self.name = name
+        self.docs = []
+        self.pipelines = []
+
+    def _matching(self, filter):
+        return [doc for doc in self.docs if matches(doc, filter)]
+
+    def _apply(self, doc, update, inserted=False):
+        for op, fields in update.items():
+            for path, value in fields.items():
+                *parents, leaf = path.split(".")
+                target = doc
+                for part in parents:
+                    target = target.setdefault(part, {})
+                if op == "$set" or (op == "$setOnInsert" and inserted):
+                    target[leaf] = value
+                elif op == "$inc":
+                    target[leaf] = target.get(leaf, 0) + value
+                elif op == "$unset":
+                    target.pop(leaf, None)
+
+    def _upsert(self, filter, update):
+        doc = {key: value for key, value in filter.items() if not key.startswith("$") and not isinstance(value, dict)}
+        self._apply(doc, update, inserted=True)
+        self._insert(doc)
+        return doc
+
+    def _insert(self, doc):
+        doc.setdefault("_id", f"{self.name}:{len(self.docs)}")
+        if any(existing["_id"] == doc["_id"] for existing in self.docs):
+            raise DuplicateKeyError(f"duplicate _id {doc['_id']!r}")
+        self.docs.append(doc)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return FakeCursor([copy.deepcopy(doc) for doc in self._matching(filter)])
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        found = self._matching(filter)
+        return copy.deepcopy(found[0]) if found else None
+
+    async def count_documents(self, filter, **kwargs):
+        return len(self._matching(filter))
+
+    def aggregate(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        first = pipeline[0]
+        filter = first["$geoNear"].get("query") if "$geoNear" in first else first.get("$match")
+        return FakeCursor([copy.deepcopy(doc) for doc in self._matching(filter)])
+
+    async def insert_one(self, doc, **kwargs):
+        self._insert(copy.deepcopy(doc))
+
+    async def insert_many(self, docs, **kwargs):
+        for doc in docs:
+            self._insert(copy.deepcopy(doc))
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        found = self._matching(filter)[:1]
+        if not found and upsert:
+            return UpdateResult(0, self._upsert(filter, update)["_id"])
+        for doc in found:
+            self._apply(doc, update)
+        return UpdateResult(len(found))
+
+    async def update_many(self, filter, update, **kwargs):
+        found = self._matching(filter)
+        for doc in found:
+            self._apply(doc, update)
+        return UpdateResult(len(found))
+
+    async def delete_one(self, filter, **kwargs):
+        found = self._matching(filter)[:1]
+        self.docs = [doc for doc in self.docs if doc not in found]
+        return DeleteResult(len(found))
+
+    async def delete_many(self, filter, **kwargs):
+        found = self._matching(filter)
+        self.docs = [doc for doc in self.docs if doc not in found]
+        return DeleteResult(len(found))
+
+    async def find_one_and_update(self, filter, update, **kwargs):
+        found = self._matching(filter)[:1]
+        before = copy.deepcopy(found[0]) if found else None
+        for doc in found:
+            self._apply(doc, update)
+        return before
+
+    async def find_one_and_delete(self, filter, **kwargs):
+        found = await self.find_one(filter)
+        await self.delete_one(filter)
+        return found
+
+    async def bulk_write(self, requests, **kwargs):
+        for op in requests:
+            if isinstance(op, InsertOne):
+                await self.insert_one(op._doc)
+            elif isinstance(op, UpdateOne):
+                await self.update_one(op._filter, op._doc, upsert=op._upsert)
+            elif isinstance(op, UpdateMany):
+                await self.update_many(op._filter, op._doc)
+            elif isinstance(op, ReplaceOne):
+                found = self._matching(op._filter)[:1]
+                for doc in found:
+                    doc.clear()
+                    doc.update(copy.deepcopy(op._doc))
+            elif isinstance(op, DeleteOne):
+                await self.delete_one(op._filter)
+            elif isinstance(op, DeleteMany):
+                await self.delete_many(op._filter)
+
+
+class FakeDatabase:
+    def __init__(self, name="forest"):
+        self.name = name
+        self.read_preference = None
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+@pytest.fixture
+def shared_db():
+    """One database holding the documents of every organization, as in the shared layout"""
+    return FakeDatabase()
+
+
+@pytest.fixture
+def run():
+    return asyncio.run
@@ -0,0 +1,178 @@
+"""
+Isolation between organizations through the tenancy wrapper
+
+    pip install -r benchmarks/requirements.txt
+    pytest tests
+
+Two offices share one (in-memory) database, as in the default layout;
+everything org A writes through tenancy must stay invisible to and
+untouchable by org B.
+"""
+import pytest
+from fastapi.testclient import TestClient
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+
+import idempotency
+import resumable
+import revisions
+import rollups
+import tenancy
+
+
+@pytest.fixture
+def org_a(shared_db):
+    return tenancy.TenantDatabase(shared_db, "org-a")
+
+
+@pytest.fixture
+def org_b(shared_db):
+    return tenancy.TenantDatabase(shared_db, "org-b")
+
+
+@pytest.fixture
+def trees(run, org_a, org_b):
+    run(org_a.trees.insert_one({"id": "a1", "species": "Oak", "health": "good"}))
+    run(org_b.trees.insert_one({"id": "b1", "species": "Pine", "health": "good"}))
+
+
+def test_writes_are_stamped_with_the_org(run, shared_db, org_a, trees):
+    assert {doc["id"]: doc["org_id"] for doc in shared_db.trees.docs} == {"a1": "org-a", "b1": "org-b"}
+
+
+def test_reads_only_see_own_trees(run, org_a, org_b, trees):
+    assert [doc["id"] for doc in run(org_a.trees.find({}).to_list(None))] == ["a1"]
+    assert run(org_b.trees.find_one({"id": "a1"})) is None
+    assert run(org_b.trees.count_documents({"health": "good"})) == 1
+
+
+def test_updates_and_deletes_cannot_reach_other_org(run, shared_db, org_b, trees):
+    assert run(org_b.trees.update_one({"id": "a1"}, {"$set": {"health": "dead"}})).matched_count == 0
+    assert run(org_b.trees.update_many({}, {"$set": {"health": "dead"}})).matched_count == 1
+    assert run(org_b.trees.find_one_and_update({"id": "a1"}, {"$set": {"health": "dead"}})) is None
+    assert run(org_b.trees.find_one_and_delete({"id": "a1"})) is None
+    assert run(org_b.trees.delete_one({"id": "a1"})).deleted_count == 0
+    assert run(org_b.trees.delete_many({})).deleted_count == 1
+    [tree] = shared_db.trees.docs
+    assert (tree["id"], tree["health"]) == ("a1", "good")
+
+
+def test_aggregate_is_scoped(run, shared_db, org_a, trees):
+    docs = run(org_a.trees.aggregate([{"$group": {"_id": "$species"}}]).to_list(None))
+    assert [doc["id"] for doc in docs] == ["a1"]
+    assert shared_db.trees.pipelines[-1][0] == {"$match": {"org_id": "org-a"}}
+
+
+def test_geo_near_stays_first_and_gets_the_org_condition(run, shared_db, org_b, trees):
+    geo_near = {"near": {"type": "Point", "coordinates": [0, 0]}, "distanceField": "d", "query": {"health": "good"}}
+    docs = run(org_b.trees.aggregate([{"$geoNear": geo_near}, {"$limit": 5}]).to_list(None))
+    assert [doc["id"] for doc in docs] == ["b1"]
+    pipeline = shared_db.trees.pipelines[-1]
+    assert pipeline[0]["$geoNear"]["query"] == {"health": "good", "org_id": "org-b"}
+    assert pipeline[0]["$geoNear"]["distanceField"] == "d"
+    assert pipeline[1:] == [{"$limit": 5}]
+
+
+def test_bulk_write_is_scoped(run, shared_db, org_a, org_b, trees):
+    run(org_b.trees.bulk_write([
+        InsertOne({"id": "b2"}),
+        UpdateOne({"id": "a1"}, {"$set": {"health": "dead"}}),
+        UpdateMany({}, {"$set": {"checked": True}}),
+        ReplaceOne({"id": "a1"}, {"id": "a1", "species": "Birch"}),
+        DeleteOne({"id": "a1"}),
+    ], ordered=False))
+    assert run(org_a.trees.find_one({"id": "a1"}))["health"] == "good"
+    assert run(org_a.trees.find_one({"id": "a1"})).get("checked") is None
+    assert run(org_b.trees.find_one({"id": "b2"}))["org_id"] == "org-b"
+    assert run(org_b.trees.count_documents({"checked": True})) == 2
+
+
+def test_unsupported_bulk_operation_is_rejected(run, org_a):
+    with pytest.raises(TypeError):
+        run(org_a.trees.bulk_write([{"insertOne": {"document": {}}}]))
+
+
+def test_time_series_collection_is_scoped_by_meta(run, shared_db, org_a, org_b):
+    run(org_a.tree_observations.insert_one({"meta": {"tree_id": "a1"}, "health": "good"}))
+    assert shared_db.tree_observations.docs[0]["meta"] == {"tree_id": "a1", "org_id": "org-a"}
+    assert run(org_b.tree_observations.find({}).to_list(None)) == []
+
+
+def test_non_tenant_collections_are_not_reachable(org_a):
+    with pytest.raises(AttributeError):
+        org_a.scheduler_locks
+
+
+def test_revisions_are_per_org(run, org_a, org_b):
+    run(revisions.bump(org_a, revisions.TREES, revisions.WORK_AREAS))
+    run(revisions.bump(org_a, revisions.TREES))
+    assert run(revisions.current(org_a, revisions.TREES)) == (2,)
+    assert run(revisions.current(org_a, revisions.WORK_AREAS)) == (1,)
+    assert run(revisions.current(org_b, revisions.TREES, revisions.WORK_AREAS)) == (0, 0)
+
+
+def test_rollups_are_per_org(run, org_a, org_b):
+    run(rollups.apply_tree_insert(org_a, {"species": "Oak", "health": "good"}))
+    run(rollups.apply_tree_insert(org_b, {"species": "Oak", "health": "good"}))
+    run(rollups.apply_tree_delete(org_b, {"species": "Oak", "health": "good"}))
+    assert run(rollups.summary_counts(org_a))["total_trees"] == 1
+    assert run(rollups.summary_counts(org_b))["total_trees"] == 0
+
+
+def test_idempotency_keys_are_per_org(run, org_a, org_b):
+    calls = []
+
+    async def create(response):
+        calls.append(response)
+        return response
+
+    assert run(idempotency.run(org_a, "trees", "key-1", {}, lambda: create("a"))) == "a"
+    assert run(idempotency.run(org_b, "trees", "key-1", {}, lambda: create("b"))) == "b"
+    assert run(idempotency.run(org_a, "trees", "key-1", {}, lambda: create("again"))) == "a"
+    assert calls == ["a", "b"]
+
+
+def test_upload_sessions_are_per_org(run, monkeypatch, tmp_path, org_a, org_b):
+    monkeypatch.setattr(resumable, "UPLOAD_SESSION_DIR", str(tmp_path))
+    session = run(resumable.create_session(org_a, "photo", 3, {}))
+    run(org_a.upload_sessions.update_one({"id": session["id"]}, {"$set": {"offset": 3}}))
+    assert run(org_b.upload_sessions.find_one({"id": session["id"]})) is None
+    assert run(resumable.claim_finalize(org_b, session["id"])) is None
+    assert run(resumable.claim_finalize(org_a, session["id"])) is not None
+
+
+def test_scoped_ids_differ_per_org(org_a, org_b):
+    assert tenancy.scoped_id(org_a, "trees") != tenancy.scoped_id(org_b, "trees")
+
+
+def _echo_org_app():
+    async def app(scope, receive, send):
+        body = tenancy.current_org().encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": body})
+    return TestClient(tenancy.TenantMiddleware(app))
+
+
+def test_middleware_binds_the_header_org():
+    client = _echo_org_app()
+    assert client.get("/api/trees", headers={"X-Org-Id": "org-a"}).text == "org-a"
+    assert client.get("/api/trees").text == tenancy.DEFAULT_ORG_ID
+
+
+@pytest.mark.parametrize("org_id", ["org a", "../admin", "x" * 49])
+def test_middleware_rejects_invalid_org_ids(org_id):
+    response = _echo_org_app().get("/api/trees", headers={"X-Org-Id": org_id})
+    assert response.status_code == 400
+
+
+def test_middleware_rejects_org_ids_too_long_for_a_database_name(monkeypatch):
+    monkeypatch.setattr(tenancy, "TENANT_DATABASES", {"*"})
+    monkeypatch.setattr(tenancy.mongo, "DATABASE_NAME", "forest_management_production")
+    response = _echo_org_app().get("/api/trees", headers={"X-Org-Id": "x" * 40})
+    assert response.status_code == 400
+
+
+def test_middleware_requires_the_header_when_configured(monkeypatch):
+    monkeypatch.setattr(tenancy, "TENANT_REQUIRED", True)
+    client = _echo_org_app()
+    assert client.get("/api/trees").status_code == 400
+    assert client.get("/api/health").status_code == 200
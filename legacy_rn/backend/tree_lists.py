@@ -0,0 +1,68 @@
+"""Cached, pre-encoded responses of GET /api/trees
+
+Field clients reload the tree list of their work area on every refresh,
+almost always with the same area_id / health filter and unchanged data.
+Encoded JSON bodies are kept in a byte-bounded LRU keyed by the filter
+and a revision counter: per area (`trees:area:<id>`) when the list is
+filtered by area, the collection-wide revisions.TREES otherwise. Tree
+writers call `bump` with the documents before and after the write, so
+an edit in one area leaves the cached lists of every other area valid.
+A hit costs one `revisions` lookup instead of the trees query and the
+JSON encoding.
+"""
+import os
+from collections import OrderedDict
+
+import executor
+import heatmap
+import kernels
+import revisions
+
+TREE_LIST_CACHE_BYTES = int(os.getenv("TREE_LIST_CACHE_MB", "128")) * 2**20
+
+
+def area_revision(area_id):
+    return f"{revisions.TREES}:area:{area_id}"
+
+
+async def bump(db, *trees):
+    """Bump the collection revision and those of every area and heatmap tile the trees were or are in"""
+    areas = {tree.get("area_id") for tree in trees if tree}
+    await revisions.bump(
+        db, revisions.TREES, *sorted(area_revision(area) for area in areas if area), *heatmap.tile_revisions(trees)
+    )
+
+
+# Response cache
+
+_lists = OrderedDict()
+_lists_bytes = 0
+
+
+def _cache_put(key, data):
+    global _lists_bytes
+    if len(data) > TREE_LIST_CACHE_BYTES:
+        return
+    if key in _lists:
+        _lists_bytes -= len(_lists.pop(key))
+    _lists[key] = data
+    _lists_bytes += len(data)
+    while _lists_bytes > TREE_LIST_CACHE_BYTES and _lists:
+        _, evicted = _lists.popitem(last=False)
+        _lists_bytes -= len(evicted)
+
+
+async def tree_list_json(db, query):
+    """UTF-8 JSON body of the trees matching an area_id/health filter"""
+    area_id = query.get("area_id")
+    name = area_revision(area_id) if area_id else revisions.TREES
+    revision, = await revisions.current(db, name)
+    key = (db.org_id, revision, area_id, query.get("health"))
+    if key in _lists:
+        _lists.move_to_end(key)
+        return _lists[key]
+
+    trees = await db.trees.find(query).to_list(None)
+    data = await executor.run_blocking(kernels.encode_json, kernels.serialize_docs(trees))
+    _cache_put(key, data)
+    return data
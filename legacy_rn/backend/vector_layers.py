@@ -0,0 +1,291 @@
+"""Vector layer storage: one metadata document per layer, one per feature
+
+Layer documents in `vector_layers` carry name, style, feature_count and
+bbox; features live in `vector_features` as GeoJSON with a 2dsphere index,
+so clients list layers cheaply and then load features viewport by
+viewport. Large GeoJSON or zipped Shapefile uploads are parsed as streams
+and inserted in batches, which also keeps layers clear of the 16 MB BSON
+document limit.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import uuid
+import zipfile
+from datetime import date, datetime, timedelta
+
+from pymongo.errors import BulkWriteError, OperationFailure
+
+import tenancy
+
+VECTOR_IMPORT_BATCH_SIZE = int(os.getenv("VECTOR_IMPORT_BATCH_SIZE", "1000"))
+VECTOR_FEATURE_LIMIT = int(os.getenv("VECTOR_FEATURE_LIMIT", "10000"))
+VECTOR_MIGRATION_LEASE_SECONDS = int(os.getenv("VECTOR_MIGRATION_LEASE_SECONDS", "3600"))
+
+GEOMETRY_LAYER_TYPES = {
+    "Point": "point", "MultiPoint": "point",
+    "LineString": "line", "MultiLineString": "line",
+    "Polygon": "polygon", "MultiPolygon": "polygon",
+}
+
+logger = logging.getLogger("vector_layers")
+
+
+async def ensure_indexes(db):
+    await db.vector_features.create_index([("org_id", 1), ("layer_id", 1), ("feature_id", 1)])
+    # Viewport queries filter on the layer and the geometry together
+    await db.vector_features.create_index([("org_id", 1), ("layer_id", 1), ("geometry", "2dsphere")])
+    try:
+        await db.vector_features.drop_index("org_id_1_geometry_2dsphere")
+    except OperationFailure:
+        pass  # already dropped
+
+
+# Feature conversion
+
+def _close_ring(ring):
+    if ring and ring[0] != ring[-1]:
+        return [*ring, ring[0]]
+    return ring
+
+
+def _normalize_geometry(geometry):
+    """Close polygon rings, which 2dsphere indexing requires"""
+    if geometry["type"] == "Polygon":
+        return {**geometry, "coordinates": [_close_ring(ring) for ring in geometry["coordinates"]]}
+    if geometry["type"] == "MultiPolygon":
+        return {**geometry, "coordinates": [[_close_ring(ring) for ring in polygon]
+                                            for polygon in geometry["coordinates"]]}
+    return geometry
+
+
+def _is_position(value):
+    return isinstance(value, list) and bool(value) and isinstance(value[0], (int, float))
+
+
+def _legacy_geometry(layer_type, coordinates):
+    """Geometry for the frontend's {coordinates: ...} features ([lng, lat] points)"""
+    if layer_type == "point":
+        point = coordinates[0] if coordinates and isinstance(coordinates[0], list) else coordinates
+        return {"type": "Point", "coordinates": point}
+    if layer_type == "line":
+        return {"type": "LineString", "coordinates": coordinates}
+    if coordinates and _is_position(coordinates[0]):
+        # A single ring without the list of rings around it
+        coordinates = [coordinates]
+    return {"type": "Polygon", "coordinates": coordinates}
+
+
+def to_feature_doc(layer_id, raw, layer_type):
+    """Feature document from a GeoJSON Feature or a legacy embedded feature"""
+    if raw.get("type") == "Feature":
+        geometry = raw["geometry"]
+    else:
+        geometry = _legacy_geometry(layer_type, raw.get("coordinates"))
+    feature_id = raw.get("id")
+    return {
+        "layer_id": layer_id,
+        "feature_id": str(feature_id) if feature_id is not None else str(uuid.uuid4()),
+        "geometry": _normalize_geometry(geometry),
+        "properties": raw.get("properties") or {},
+    }
+
+
+def _positions(coordinates):
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for part in coordinates or []:
+            yield from _positions(part)
+
+
+def _batch_bbox(docs):
+    lngs, lats = [], []
+    for doc in docs:
+        for position in _positions(doc["geometry"]["coordinates"]):
+            lngs.append(position[0])
+            lats.append(position[1])
+    if not lngs:
+        return None
+    return {"min_lng": min(lngs), "min_lat": min(lats), "max_lng": max(lngs), "max_lat": max(lats)}
+
+
+# Writes
+
+async def insert_features(db, layer_id, docs):
+    """Insert one batch and grow the layer's feature_count and bbox
+
+    Features Mongo rejects (invalid geometry) are skipped; returns
+    (inserted, skipped).
+    """
+    if not docs:
+        return 0, 0
+    try:
+        result = await db.vector_features.insert_many(docs, ordered=False)
+        inserted_docs = docs
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        failed = {error["index"] for error in e.details["writeErrors"]}
+        inserted_docs = [doc for i, doc in enumerate(docs) if i not in failed]
+        inserted = e.details["nInserted"]
+
+    update = {"$inc": {"feature_count": inserted}, "$set": {"updated_at": datetime.utcnow()}}
+    bounds = _batch_bbox(inserted_docs)
+    if bounds:
+        update["$min"] = {"bbox.min_lng": bounds["min_lng"], "bbox.min_lat": bounds["min_lat"]}
+        update["$max"] = {"bbox.max_lng": bounds["max_lng"], "bbox.max_lat": bounds["max_lat"]}
+    await db.vector_layers.update_one({"id": layer_id}, update)
+    return inserted, len(docs) - inserted
+
+
+async def insert_feature_stream(db, layer_id, layer_type, features):
+    """Insert an iterable of raw features in VECTOR_IMPORT_BATCH_SIZE batches
+
+    `features` may be a lazy parser; each batch is pulled in a worker thread
+    so parsing never blocks the event loop.
+    """
+    iterator = iter(features)
+    inserted = skipped = 0
+    while True:
+        raw_batch = await asyncio.to_thread(
+            lambda: list(itertools.islice(iterator, VECTOR_IMPORT_BATCH_SIZE))
+        )
+        if not raw_batch:
+            break
+        docs = []
+        for raw in raw_batch:
+            try:
+                docs.append(to_feature_doc(layer_id, raw, layer_type))
+            except (KeyError, TypeError, IndexError):
+                skipped += 1
+        batch_inserted, batch_skipped = await insert_features(db, layer_id, docs)
+        inserted += batch_inserted
+        skipped += batch_skipped
+    return inserted, skipped
+
+
+# Import parsers (lazy: ijson and pyshp are only needed for uploads)
+
+def iter_geojson_features(file):
+    """Stream Features out of a GeoJSON FeatureCollection file object"""
+    import ijson
+
+    return ijson.items(file, "features.item", use_float=True)
+
+
+def iter_shapefile_features(zip_path):
+    """Stream GeoJSON Features out of a zipped Shapefile (WGS84 expected)"""
+    import shapefile
+
+    reader = shapefile.Reader(zip_path)
+    try:
+        for shape_record in reader.iterShapeRecords():
+            if shape_record.shape.shapeType == shapefile.NULL:
+                continue
+            yield {
+                "type": "Feature",
+                "geometry": shape_record.shape.__geo_interface__,
+                # BSON has no plain date type
+                "properties": {key: value.isoformat() if isinstance(value, date) else value
+                               for key, value in shape_record.record.as_dict().items()},
+            }
+    finally:
+        reader.close()
+
+
+def import_errors():
+    """Exceptions that mean an uploaded file is malformed, not that the server failed"""
+    import ijson
+    import shapefile
+
+    return ijson.JSONError, shapefile.ShapefileException, zipfile.BadZipFile, ValueError, KeyError
+
+
+async def peek_layer_type(features):
+    """Layer type from the first feature; returns (layer_type, features)"""
+    iterator = iter(features)
+    first = await asyncio.to_thread(next, iterator, None)
+    if first is None:
+        return None, iter(())
+    geometry = (first.get("geometry") if isinstance(first, dict) else None) or {}
+    return GEOMETRY_LAYER_TYPES.get(geometry.get("type")), itertools.chain([first], iterator)
+
+
+# Reads
+
+async def list_layers(db):
+    return await db.vector_layers.find({}, {"data": 0}).to_list(None)
+
+
+async def features_in_bbox(db, layer_id, bbox=None, limit=VECTOR_FEATURE_LIMIT):
+    """Features of a layer intersecting (min_lat, min_lng, max_lat, max_lng)"""
+    query = {"layer_id": layer_id}
+    if bbox:
+        min_lat, min_lng, max_lat, max_lng = bbox
+        query["geometry"] = {"$geoIntersects": {"$geometry": {
+            "type": "Polygon",
+            "coordinates": [[
+                [min_lng, min_lat], [max_lng, min_lat], [max_lng, max_lat],
+                [min_lng, max_lat], [min_lng, min_lat],
+            ]],
+        }}}
+    docs = await db.vector_features.find(
+        query, {"_id": 0, "feature_id": 1, "geometry": 1, "properties": 1}
+    ).limit(limit).to_list(None)
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {"type": "Feature", "id": doc["feature_id"], "geometry": doc["geometry"],
+             "properties": doc.get("properties", {})}
+            for doc in docs
+        ],
+        "truncated": len(docs) >= limit,
+    }
+
+
+# Migration of layers created before features were split out
+
+async def _claim_layer(database, layer):
+    """Mark the layer as being migrated by this process; False if another one holds it
+
+    The claim expires after VECTOR_MIGRATION_LEASE_SECONDS so a crashed
+    migration is picked up again by a later run.
+    """
+    now = datetime.utcnow()
+    claimed = await database.vector_layers.find_one_and_update(
+        {"_id": layer["_id"], "data": {"$exists": True},
+         "$or": [{"migrating_until": {"$exists": False}}, {"migrating_until": {"$lt": now}}]},
+        {"$set": {"migrating_until": now + timedelta(seconds=VECTOR_MIGRATION_LEASE_SECONDS)}},
+    )
+    return claimed is not None
+
+
+async def migrate_embedded_layers(database):
+    async for layer in database.vector_layers.find({"data": {"$exists": True}}):
+        if not await _claim_layer(database, layer):
+            continue
+        db = tenancy.TenantDatabase(database, layer.get("org_id", tenancy.DEFAULT_ORG_ID))
+        try:
+            # Restart cleanly if an earlier migration was interrupted
+            await db.vector_features.delete_many({"layer_id": layer["id"]})
+            await db.vector_layers.update_one(
+                {"_id": layer["_id"]}, {"$set": {"feature_count": 0}, "$unset": {"bbox": ""}}
+            )
+            _, skipped = await insert_feature_stream(
+                db, layer["id"], layer.get("layer_type"), layer.get("data") or []
+            )
+            if skipped:
+                # Keep the original features so nothing is lost; the next run retries
+                error = f"{skipped} features could not be converted"
+                logger.warning("Vector layer %s: %s", layer.get("id"), error)
+                await db.vector_layers.update_one(
+                    {"_id": layer["_id"]}, {"$set": {"migration_error": error}, "$unset": {"migrating_until": ""}}
+                )
+            else:
+                await db.vector_layers.update_one(
+                    {"_id": layer["_id"]}, {"$unset": {"data": "", "migration_error": "", "migrating_until": ""}}
+                )
+        except Exception:
+            logger.exception("Migrating vector layer %s failed", layer.get("id"))
+            await db.vector_layers.update_one({"_id": layer["_id"]}, {"$unset": {"migrating_until": ""}})
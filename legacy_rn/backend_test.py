@@ -25,10 +25,14 @@ class ForestManagementAPITester:
         }
 
     def run_test(self, name: str, method: str, endpoint: str, expected_status: int, 
-                 data: Optional[Dict[str, Any]] = None, params: Optional[Dict[str, str]] = None) -> tuple:
+                 data: Optional[Dict[str, Any]] = None, params: Optional[Dict[str, str]] = None,
+                 headers: Optional[Dict[str, str]] = None, files: Optional[Dict[str, Any]] = None,
+                 body: Optional[bytes] = None) -> tuple:
         """Run a single API test"""
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', **(headers or {})}
+        if files is not None or body is not None:
+            del headers['Content-Type']
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -37,8 +41,12 @@ class ForestManagementAPITester:
         try:
             if method == 'GET':
                 response = requests.get(url, headers=headers, params=params)
+            elif method == 'POST' and files is not None:
+                response = requests.post(url, files=files, data=data, headers=headers)
             elif method == 'POST':
                 response = requests.post(url, json=data, headers=headers)
+            elif method == 'PATCH':
+                response = requests.patch(url, data=body, headers=headers)
             elif method == 'PUT':
                 response = requests.put(url, json=data, headers=headers)
             elif method == 'DELETE':
@@ -426,6 +434,628 @@ class ForestManagementAPITester:
         
         return success and success2
 
+    def test_health_endpoints(self):
+        """Test liveness and readiness endpoints"""
+        print("\n" + "="*50)
+        print("TESTING HEALTH ENDPOINTS")
+        print("="*50)
+        
+        success, _ = self.run_test(
+            "Liveness",
+            "GET",
+            "/api/health",
+            200
+        )
+        
+        success2, ready_response = self.run_test(
+            "Readiness",
+            "GET",
+            "/api/ready",
+            200
+        )
+        
+        if success2:
+            print(f"   Mongo reachable: {ready_response.get('mongo', 'N/A')}")
+        
+        return success and success2
+
+    def test_tree_query_operations(self):
+        """Test nearest-tree, survey and history endpoints"""
+        print("\n" + "="*50)
+        print("TESTING TREE QUERY OPERATIONS")
+        print("="*50)
+        
+        tree_data = {
+            "species": "ヒノキ",
+            "health": "healthy",
+            "lat": 35.6765,
+            "lng": 139.6506,
+            "diameter": 30.0,
+            "height": 18.0,
+            "notes": "近傍検索テスト"
+        }
+        
+        success, tree_response = self.run_test(
+            "Create Tree For Queries",
+            "POST",
+            "/api/trees",
+            200,
+            data=tree_data
+        )
+        
+        if not success:
+            return False
+        
+        tree_id = tree_response.get('id')
+        self.created_resources['trees'].append(tree_id)
+        
+        # Nearest trees
+        success, nearest_response = self.run_test(
+            "Get Nearest Trees",
+            "GET",
+            "/api/trees/nearest",
+            200,
+            params={"lat": "35.6765", "lng": "139.6506", "k": "5"}
+        )
+        
+        if success:
+            print(f"   Found {len(nearest_response)} nearby trees")
+        
+        self.run_test(
+            "Get Nearest Trees (latitude out of range)",
+            "GET",
+            "/api/trees/nearest",
+            422,
+            params={"lat": "95", "lng": "139.6506"}
+        )
+        
+        batch_data = {
+            "queries": [
+                {"lat": 35.6765, "lng": 139.6506},
+                {"lat": 35.6800, "lng": 139.6600, "k": 3}
+            ],
+            "k": 5,
+            "max_distance": 1000
+        }
+        
+        success2, batch_response = self.run_test(
+            "Get Nearest Trees Batch",
+            "POST",
+            "/api/trees/nearest/batch",
+            200,
+            data=batch_data
+        )
+        
+        if success2:
+            print(f"   Batch results: {len(batch_response)}")
+        
+        # Field survey
+        survey_data = {
+            "observations": [
+                {"tree_id": tree_id, "health": "warning", "diameter": 30.5},
+                {"tree_id": str(uuid.uuid4()), "health": "critical"}
+            ]
+        }
+        
+        success3, survey_response = self.run_test(
+            "Submit Survey",
+            "POST",
+            "/api/trees/survey",
+            200,
+            data=survey_data
+        )
+        
+        if success3:
+            print(f"   Updated: {survey_response.get('updated', 0)}, missing: {len(survey_response.get('missing', []))}")
+        
+        # Observation history
+        success4, history_response = self.run_test(
+            "Get Tree History",
+            "GET",
+            f"/api/trees/{tree_id}/history",
+            200
+        )
+        
+        if success4:
+            print(f"   History entries: {len(history_response)}")
+        
+        self.run_test(
+            "Get History Of Unknown Tree",
+            "GET",
+            f"/api/trees/{uuid.uuid4()}/history",
+            404
+        )
+        
+        return success and success2 and success3 and success4
+
+    def test_work_area_analytics(self):
+        """Test work area trends and stand metrics"""
+        print("\n" + "="*50)
+        print("TESTING WORK AREA ANALYTICS")
+        print("="*50)
+        
+        area_data = {
+            "name": "エリアB",
+            "status": "active",
+            "boundary": [
+                [35.6760, 139.6500],
+                [35.6770, 139.6500],
+                [35.6770, 139.6510],
+                [35.6760, 139.6510]
+            ]
+        }
+        
+        success, area_response = self.run_test(
+            "Create Work Area For Analytics",
+            "POST",
+            "/api/work-areas",
+            200,
+            data=area_data
+        )
+        
+        if not success:
+            return False
+        
+        area_id = area_response.get('id')
+        self.created_resources['work_areas'].append(area_id)
+        print(f"   Area: {area_response.get('area_ha', 0):.3f} ha")
+        
+        # The mobile client creates areas before drawing their boundary
+        success2, empty_area = self.run_test(
+            "Create Work Area Without Boundary",
+            "POST",
+            "/api/work-areas",
+            200,
+            data={"name": "エリアC", "status": "planned", "boundary": []}
+        )
+        
+        if success2:
+            self.created_resources['work_areas'].append(empty_area.get('id'))
+        
+        success3, trends_response = self.run_test(
+            "Get Work Area Trends",
+            "GET",
+            f"/api/work-areas/{area_id}/trends",
+            200,
+            params={"interval": "month"}
+        )
+        
+        if success3:
+            print(f"   Trend points: {len(trends_response)}")
+        
+        self.run_test(
+            "Get Work Area Trends (invalid interval)",
+            "GET",
+            f"/api/work-areas/{area_id}/trends",
+            400,
+            params={"interval": "fortnight"}
+        )
+        
+        success4, stands_response = self.run_test(
+            "Get Stand Metrics",
+            "GET",
+            "/api/analytics/stands",
+            200
+        )
+        
+        if success4:
+            print(f"   Stands: {len(stands_response)}")
+        
+        success5, stand_response = self.run_test(
+            "Get Stand Metrics Of Area",
+            "GET",
+            f"/api/analytics/stands/{area_id}",
+            200
+        )
+        
+        if success5:
+            print(f"   Trees per ha: {stand_response.get('trees_per_ha', 'N/A')}")
+        
+        self.run_test(
+            "Get Stand Metrics Of Unknown Area",
+            "GET",
+            f"/api/analytics/stands/{uuid.uuid4()}",
+            404
+        )
+        
+        success6, _ = self.run_test(
+            "Get Stand Metrics Of Polygon",
+            "POST",
+            "/api/analytics/stands/polygon",
+            200,
+            data={"boundary": area_data["boundary"]}
+        )
+        
+        self.run_test(
+            "Get Stand Metrics Of Polygon (too few points)",
+            "POST",
+            "/api/analytics/stands/polygon",
+            400,
+            data={"boundary": area_data["boundary"][:2]}
+        )
+        
+        return success2 and success3 and success4 and success5 and success6
+
+    def test_heatmap_endpoints(self):
+        """Test heatmap rasters and tiles"""
+        print("\n" + "="*50)
+        print("TESTING HEATMAP ENDPOINTS")
+        print("="*50)
+        
+        bbox = "35.670,139.645,35.680,139.655"
+        
+        success, _ = self.run_test(
+            "Get Density Heatmap",
+            "GET",
+            "/api/analytics/heatmap",
+            200,
+            params={"bbox": bbox, "cell_size": "50"}
+        )
+        
+        success2, _ = self.run_test(
+            "Get Health Heatmap Grid",
+            "GET",
+            "/api/analytics/heatmap",
+            200,
+            params={"bbox": bbox, "metric": "health", "format": "bin"}
+        )
+        
+        self.run_test(
+            "Get Heatmap (invalid metric)",
+            "GET",
+            "/api/analytics/heatmap",
+            400,
+            params={"bbox": bbox, "metric": "age"}
+        )
+        
+        success3, _ = self.run_test(
+            "Get Heatmap Tile",
+            "GET",
+            "/api/analytics/heatmap/tiles/14/14552/6451.png",
+            200
+        )
+        
+        self.run_test(
+            "Get Heatmap Tile (invalid coordinates)",
+            "GET",
+            "/api/analytics/heatmap/tiles/2/4/0.png",
+            400
+        )
+        
+        success4, days_response = self.run_test(
+            "Get Trees Per Day",
+            "GET",
+            "/api/analytics/trees-per-day",
+            200
+        )
+        
+        if success4:
+            print(f"   Days: {len(days_response)}")
+        
+        return success and success2 and success3 and success4
+
+    def test_vector_layer_import(self):
+        """Test vector file import and feature queries"""
+        print("\n" + "="*50)
+        print("TESTING VECTOR LAYER IMPORT")
+        print("="*50)
+        
+        geojson = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "geometry": {
+                        "type": "Polygon",
+                        "coordinates": [[
+                            [139.6503, 35.6762],
+                            [139.6513, 35.6772],
+                            [139.6503, 35.6782],
+                            [139.6503, 35.6762]
+                        ]]
+                    },
+                    "properties": {"name": "インポートポリゴン"}
+                }
+            ]
+        }
+        
+        success, layer_response = self.run_test(
+            "Import GeoJSON Layer",
+            "POST",
+            "/api/vector-layers/import",
+            200,
+            data={"name": "インポートレイヤー"},
+            files={"file": ("stands.geojson", json.dumps(geojson), "application/geo+json")}
+        )
+        
+        if not success:
+            return False
+        
+        layer_id = layer_response.get('id')
+        self.created_resources['vector_layers'].append(layer_id)
+        print(f"   Imported features: {layer_response.get('feature_count', 0)}")
+        
+        success2, features_response = self.run_test(
+            "Get Layer Features In BBox",
+            "GET",
+            f"/api/vector-layers/{layer_id}/features",
+            200,
+            params={"bbox": "35.670,139.645,35.680,139.655"}
+        )
+        
+        if success2:
+            print(f"   Features in bbox: {len(features_response.get('features', []))}")
+        
+        self.run_test(
+            "Get Features Of Unknown Layer",
+            "GET",
+            f"/api/vector-layers/{uuid.uuid4()}/features",
+            404
+        )
+        
+        self.run_test(
+            "Import Malformed GeoJSON",
+            "POST",
+            "/api/vector-layers/import",
+            400,
+            files={"file": ("broken.geojson", '{"type": "FeatureCollection", "features": [', "application/geo+json")}
+        )
+        
+        self.run_test(
+            "Import Unsupported File Type",
+            "POST",
+            "/api/vector-layers/import",
+            400,
+            files={"file": ("stands.kml", "<kml/>", "application/xml")}
+        )
+        
+        return success2
+
+    def test_resumable_uploads(self):
+        """Test resumable upload of a GPS track file"""
+        print("\n" + "="*50)
+        print("TESTING RESUMABLE UPLOADS")
+        print("="*50)
+        
+        track = json.dumps({
+            "name": "再開可能アップロード",
+            "points": [
+                {"lat": 35.6762, "lng": 139.6503, "timestamp": datetime.now().isoformat()},
+                {"lat": 35.6772, "lng": 139.6513, "timestamp": datetime.now().isoformat()}
+            ],
+            "track_type": "path"
+        }).encode()
+        half = len(track) // 2
+        
+        success, upload_response = self.run_test(
+            "Create Upload",
+            "POST",
+            "/api/uploads",
+            200,
+            data={"kind": "gps_track", "length": len(track), "filename": "track.json"}
+        )
+        
+        if not success:
+            return False
+        
+        upload_id = upload_response.get('id')
+        
+        success2, _ = self.run_test(
+            "Upload First Chunk",
+            "PATCH",
+            f"/api/uploads/{upload_id}",
+            200,
+            headers={"Upload-Offset": "0"},
+            body=track[:half]
+        )
+        
+        self.run_test(
+            "Finalize Incomplete Upload",
+            "POST",
+            f"/api/uploads/{upload_id}/finalize",
+            409
+        )
+        
+        self.run_test(
+            "Upload Chunk At Wrong Offset",
+            "PATCH",
+            f"/api/uploads/{upload_id}",
+            409,
+            headers={"Upload-Offset": "0"},
+            body=track[half:]
+        )
+        
+        success3, status_response = self.run_test(
+            "Get Upload Status",
+            "GET",
+            f"/api/uploads/{upload_id}",
+            200
+        )
+        
+        if success3:
+            print(f"   Offset: {status_response.get('offset')} / {status_response.get('length')}")
+        
+        success4, _ = self.run_test(
+            "Upload Last Chunk",
+            "PATCH",
+            f"/api/uploads/{upload_id}",
+            200,
+            headers={"Upload-Offset": str(half)},
+            body=track[half:]
+        )
+        
+        success5, track_response = self.run_test(
+            "Finalize Upload",
+            "POST",
+            f"/api/uploads/{upload_id}/finalize",
+            200
+        )
+        
+        track_id = track_response.get('id')
+        if track_id:
+            self.created_resources['gps_tracks'].append(track_id)
+            print(f"   Created track ID: {track_id}")
+        
+        success6, again_response = self.run_test(
+            "Finalize Upload Again",
+            "POST",
+            f"/api/uploads/{upload_id}/finalize",
+            200
+        )
+        
+        if success6 and again_response.get('id') != track_id:
+            print("❌ Repeated finalize created a second track")
+            success6 = False
+        
+        self.run_test(
+            "Create Upload (invalid kind)",
+            "POST",
+            "/api/uploads",
+            400,
+            data={"kind": "video", "length": 10}
+        )
+        
+        return success2 and success3 and success4 and success5 and success6
+
+    def test_idempotency_keys(self):
+        """Test that retried creates with an Idempotency-Key create one tree"""
+        print("\n" + "="*50)
+        print("TESTING IDEMPOTENCY KEYS")
+        print("="*50)
+        
+        key = str(uuid.uuid4())
+        tree_data = {
+            "species": "マツ",
+            "health": "healthy",
+            "lat": 35.6770,
+            "lng": 139.6510
+        }
+        
+        success, first = self.run_test(
+            "Create Tree With Idempotency-Key",
+            "POST",
+            "/api/trees",
+            200,
+            data=tree_data,
+            headers={"Idempotency-Key": key}
+        )
+        
+        if not success:
+            return False
+        
+        self.created_resources['trees'].append(first.get('id'))
+        
+        success2, retry = self.run_test(
+            "Retry Create Tree",
+            "POST",
+            "/api/trees",
+            200,
+            data=tree_data,
+            headers={"Idempotency-Key": key}
+        )
+        
+        if success2 and retry.get('id') != first.get('id'):
+            print("❌ Retry created a second tree")
+            success2 = False
+        
+        success3, _ = self.run_test(
+            "Reuse Idempotency-Key With Other Payload",
+            "POST",
+            "/api/trees",
+            422,
+            data={**tree_data, "species": "カラマツ"},
+            headers={"Idempotency-Key": key}
+        )
+        
+        return success2 and success3
+
+    def test_tenant_isolation(self):
+        """Test that organizations cannot see each other's trees"""
+        print("\n" + "="*50)
+        print("TESTING TENANT ISOLATION")
+        print("="*50)
+        
+        org_a = {"X-Org-Id": f"test-a-{uuid.uuid4().hex[:8]}"}
+        org_b = {"X-Org-Id": f"test-b-{uuid.uuid4().hex[:8]}"}
+        
+        success, tree_response = self.run_test(
+            "Create Tree In Org A",
+            "POST",
+            "/api/trees",
+            200,
+            data={"species": "ブナ", "health": "healthy", "lat": 35.6762, "lng": 139.6503},
+            headers=org_a
+        )
+        
+        if not success:
+            return False
+        
+        tree_id = tree_response.get('id')
+        
+        success2, _ = self.run_test(
+            "Get Org A Tree From Org B",
+            "GET",
+            f"/api/trees/{tree_id}",
+            404,
+            headers=org_b
+        )
+        
+        success3, _ = self.run_test(
+            "Delete Org A Tree From Org B",
+            "DELETE",
+            f"/api/trees/{tree_id}",
+            404,
+            headers=org_b
+        )
+        
+        success4, summary = self.run_test(
+            "Get Org B Summary",
+            "GET",
+            "/api/analytics/summary",
+            200,
+            headers=org_b
+        )
+        
+        if success4 and summary.get('total_trees', 0) != 0:
+            print("❌ Org B summary counts org A trees")
+            success4 = False
+        
+        success5, _ = self.run_test(
+            "Invalid X-Org-Id",
+            "GET",
+            "/api/trees",
+            400,
+            headers={"X-Org-Id": "../admin"}
+        )
+        
+        self.run_test(
+            "Delete Tree In Org A",
+            "DELETE",
+            f"/api/trees/{tree_id}",
+            200,
+            headers=org_a
+        )
+        
+        return success2 and success3 and success4 and success5
+
+    def test_scheduler_endpoints(self):
+        """Test background job status endpoint"""
+        print("\n" + "="*50)
+        print("TESTING SCHEDULER ENDPOINTS")
+        print("="*50)
+        
+        success, jobs_response = self.run_test(
+            "Get Scheduler Jobs",
+            "GET",
+            "/api/scheduler/jobs",
+            200
+        )
+        
+        if success:
+            print(f"   Leader: {jobs_response.get('leader', 'N/A')}")
+        
+        return success
+
     def cleanup_test_data(self):
         """Clean up created test data"""
         print("\n" + "="*50)
@@ -489,6 +1119,15 @@ class ForestManagementAPITester:
         test_results.append(self.test_analytics_endpoints())
         test_results.append(self.test_export_endpoints())
         test_results.append(self.test_report_generation())
+        test_results.append(self.test_health_endpoints())
+        test_results.append(self.test_tree_query_operations())
+        test_results.append(self.test_work_area_analytics())
+        test_results.append(self.test_heatmap_endpoints())
+        test_results.append(self.test_vector_layer_import())
+        test_results.append(self.test_resumable_uploads())
+        test_results.append(self.test_idempotency_keys())
+        test_results.append(self.test_tenant_isolation())
+        test_results.append(self.test_scheduler_endpoints())
         
         # Clean up test data
         self.cleanup_test_data()